@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Movie, Comment, WatchHistory, Visitor, DownloadHistory
+from .models import Movie, Comment, WatchHistory, Visitor, DownloadHistory, TranscodeJob
 from django.db.models import Sum  # ✅ for aggregations
 
 
@@ -35,12 +35,22 @@ class DownloadHistoryAdmin(admin.ModelAdmin):
     search_fields = ("movie__name", "user__username", "ip_address")
 
 
+@admin.register(TranscodeJob)
+class TranscodeJobAdmin(admin.ModelAdmin):
+    list_display = ("movie", "status", "attempts", "run_after", "locked_by", "created_at", "finished_at")
+    list_filter = ("status",)
+    search_fields = ("movie__name", "last_error")
+    readonly_fields = ("attempts", "locked_by", "locked_at", "last_error", "created_at", "finished_at")
+
+
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
-    list_display = ("name", "genre", "download_count", "uploaded_at")  # added genre
+    list_display = ("name", "genre", "download_count", "transcode_status", "uploaded_at")  # added genre
     ordering = ("-download_count", "-uploaded_at")
     search_fields = ("name", "genre")  # include genre in search
     list_filter = ("genre",)  # allow filtering by genre in the sidebar
+    readonly_fields = ("transcode_status", "video_codec", "audio_codec", "video_width", "video_height",
+                       "duration_seconds", "bitrate_kbps", "hls_playlist")
 
     def changelist_view(self, request, extra_context=None):
         """
@@ -1,6 +1,16 @@
+import mimetypes
+
 from django.apps import AppConfig
 
 
 class MoviesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'movies'
+
+    def ready(self):
+        # Register signal handlers (denormalized counters, cache invalidation, ...)
+        from . import signals  # noqa: F401
+
+        # HLS files served from MEDIA_ROOT (".ts" defaults to a Qt translation type)
+        mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+        mimetypes.add_type("video/mp2t", ".ts")
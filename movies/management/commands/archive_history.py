@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from movies.utils import archive
+from movies.utils.exports import FORMATS
+
+
+class Command(BaseCommand):
+    help = ("Move watch/download history older than HISTORY_RETENTION_MONTHS into gzip archive files, "
+            "one new part file per table, month and run, keeping the movie totals and dashboard rollups intact.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, help='Months to keep in the database, current one included')
+        parser.add_argument('--format', choices=FORMATS, default='ndjson', help='Archive file format')
+        parser.add_argument('--output-dir', help='Where to write the archives (default HISTORY_ARCHIVE_DIR)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        done = archive.archive_expired(
+            months=options['months'], fmt=options['format'], directory=options['output_dir'],
+            dry_run=dry_run, log=lambda line: self.stdout.write(("[DRY] " if dry_run else "") + line),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Months archived: {len(done)}, rows: {sum(done.values())}"))
@@ -0,0 +1,51 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies.utils.autocomplete import PrefixIndex, title_index
+
+
+class Command(BaseCommand):
+    help = "Report memory use and query latency of the in-process autocomplete index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Build a throwaway index of N generated titles instead of loading the catalog')
+        parser.add_argument('--queries', type=int, default=2000, help='Number of random prefix queries to time')
+
+    def handle(self, *args, **options):
+        if options['synthetic']:
+            index = PrefixIndex()
+            index.build(self._synthetic_rows(options['synthetic']))
+        else:
+            index = title_index
+            index.load_from_db()
+
+        stats = index.stats()
+        titles = stats['titles'] or 1
+        self.stdout.write(f"Titles: {stats['titles']}  words: {stats['tokens']}  postings: {stats['postings']}")
+        self.stdout.write(f"Memory: {stats['bytes'] / 1024 / 1024:.1f} MiB "
+                          f"({stats['bytes'] * 100000 / titles / 1024 / 1024:.1f} MiB per 100k titles)")
+
+        words = list({w for _, name in index.suggest('a', 50) for w in name.split()}) or ['a']
+        prefixes = [w[:random.randint(1, len(w))] for w in words]
+        started = time.perf_counter()
+        for i in range(options['queries']):
+            index.suggest(prefixes[i % len(prefixes)], 5)
+        per_query = (time.perf_counter() - started) / max(options['queries'], 1)
+        self.stdout.write(self.style.SUCCESS(f"Average suggest() latency: {per_query * 1000:.3f} ms"))
+
+    @staticmethod
+    def _synthetic_rows(n):
+        """Titles of 1-4 words built from Kinyarwanda/French-like syllables."""
+        rng = random.Random(42)
+        syllables = ["ka", "ki", "ru", "mu", "nya", "ba", "gi", "se", "ra", "wa", "ndi", "ho",
+                     "za", "ma", "to", "li", "é", "è", "on", "ri", "cy", "shy", "bwa", "ge"]
+        vocab = ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+                 for _ in range(max(n // 4, 50))]
+        vocab += ["Les", "La", "Nuit", "Kigali", "Rwanda", "Été", "Amahoro", "Urukundo"]
+        for i in range(n):
+            words = [vocab[min(int(rng.paretovariate(1.2)) - 1, len(vocab) - 1)] if rng.random() < 0.3
+                     else rng.choice(vocab) for _ in range(rng.randint(1, 4))]
+            yield i, " ".join(words), rng.randint(0, 5000)
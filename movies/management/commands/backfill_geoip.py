@@ -0,0 +1,66 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from movies.models import Visitor
+from movies.utils.enrichment import save_locations
+from movies.utils.geoip import GeoResolver
+
+_worker_resolver = None
+
+
+def _init_worker(path):
+    global _worker_resolver
+    django.setup()  # no-op when forked; needed with the "spawn" start method
+    _worker_resolver = GeoResolver(path=path)
+
+
+def _resolve_chunk(ips):
+    """Runs in a pool process: its own mmap reader, no database access."""
+    return _worker_resolver.locate_many(ips)
+
+
+class Command(BaseCommand):
+    help = "Resolve GeoIP locations of visitors that have none, in parallel chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Lookup processes')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Visitors per chunk')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Also retry visitors whose earlier lookup found nothing (e.g. after a database update)')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        qs = Visitor.objects.filter(geo_checked_at__isnull=True)
+        if options['retry_failed']:
+            qs = Visitor.objects.filter(geo_checked_at__isnull=True) | Visitor.objects.filter(country='')
+        qs = qs.order_by('id').only('id', 'ip_address', 'country', 'city', 'lat', 'lng', 'geohash')
+
+        resolver = GeoResolver()
+        if not os.path.exists(resolver.path):
+            self.stderr.write(self.style.ERROR(f"GeoIP database not found: {resolver.path}"))
+            return
+
+        updated = located_count = 0
+        checked_at = timezone.now()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker,
+                                 initargs=(resolver.path,)) as pool:
+            last_id = 0
+            while True:
+                # one batch of chunks in flight at a time; keyset over id
+                batch = list(qs.filter(id__gt=last_id)[:chunk_size * options['workers']])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+                results = pool.map(_resolve_chunk, [[v.ip_address for v in chunk] for chunk in chunks])
+                for chunk, located in zip(chunks, results):
+                    save_locations(chunk, located, checked_at)
+                    updated += len(chunk)
+                    located_count += sum(1 for loc in located.values() if loc[0])
+                self.stdout.write(f"Processed {updated} visitors...")
+
+        self.stdout.write(self.style.SUCCESS(f"Done. Visitors checked: {updated}, located: {located_count}"))
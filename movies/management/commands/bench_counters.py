@@ -0,0 +1,85 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.test.utils import override_settings
+
+from movies.models import DownloadHistory, Movie
+from movies.utils import counters
+
+
+class Command(BaseCommand):
+    help = ("Benchmark concurrent increments of one movie's download_count: "
+            "direct row UPDATE versus sharded counters. Runs against a throwaway "
+            "test database and a local cache, never the configured ones.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent writers')
+        parser.add_argument('--increments', type=int, default=200, help='Increments per writer')
+
+    def handle(self, *args, **options):
+        test_settings = connection.settings_dict["TEST"]
+        if connection.vendor == "sqlite" and not test_settings.get("NAME"):
+            # a file, not the shared in-memory database: writers need real locking
+            test_settings["NAME"] = os.path.join(tempfile.gettempdir(), "bench_counters.sqlite3")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+                self._bench(options['threads'], options['increments'])
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _bench(self, threads, per_thread):
+        # bulk_create: no signals, no transcode job, no catalog cache bump
+        movie = Movie.objects.bulk_create([Movie(name="bench_counters")])[0]
+
+        # same shape as download_movie: history row + counter in one transaction
+        def direct():
+            with transaction.atomic():
+                DownloadHistory.objects.create(movie=movie, ip_address="127.0.0.1")
+                Movie.objects.filter(id=movie.id).update(download_count=F("download_count") + 1)
+
+        def sharded():
+            with transaction.atomic():
+                DownloadHistory.objects.create(movie=movie, ip_address="127.0.0.1")
+                counters.increment(movie.id, "download_count")
+
+        for label, func in (("row update", direct), ("sharded", sharded)):
+            elapsed = self._run(func, threads, per_thread)
+            rate = threads * per_thread / elapsed
+            self.stdout.write(f"{label:>10}: {threads} x {per_thread} increments in {elapsed:.2f}s "
+                              f"-> {rate:,.0f} increments/s")
+
+        counters.fold([movie.id])
+        movie.refresh_from_db()
+        expected = 2 * threads * per_thread
+        status = self.style.SUCCESS if movie.download_count == expected else self.style.ERROR
+        self.stdout.write(status(f"Final download_count {movie.download_count} (expected {expected})"))
+
+    @staticmethod
+    def _run(func, threads, per_thread):
+        start_gate = threading.Barrier(threads + 1)
+
+        def worker():
+            start_gate.wait()
+            try:
+                for _ in range(per_thread):
+                    func()
+            finally:
+                connections.close_all()
+
+        pool = [threading.Thread(target=worker) for _ in range(threads)]
+        for t in pool:
+            t.start()
+        start_gate.wait()
+        started = time.perf_counter()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+        connection.close()
+        return elapsed
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.utils.exports import FORMATS, export_queryset, export_sources, iter_export, parse_bound
+
+
+class Command(BaseCommand):
+    help = "Stream watch, download or visitor history to a file (or stdout) as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export_sources()), help='What to export')
+        parser.add_argument('--format', choices=FORMATS, default='csv', help='Output format')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output')
+        parser.add_argument('--since', help='Only rows at or after this ISO date/datetime')
+        parser.add_argument('--until', help='Only rows before this ISO date/datetime')
+        parser.add_argument('--output', '-o', help='Output file (default stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            since, until = parse_bound(options['since']), parse_bound(options['until'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        qs, fields = export_queryset(options['kind'], since, until)
+        blocks = iter_export(qs, fields, options['format'], options['gzip'])
+
+        if not options['output']:
+            for block in blocks:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
+            return
+        written = 0
+        with open(options['output'], 'wb') as out:
+            for block in blocks:
+                out.write(block)
+                written += len(block)
+        self.stderr.write(self.style.SUCCESS(f"Done. Wrote {written} bytes to {options['output']}"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from movies.utils import counters
+
+
+class Command(BaseCommand):
+    help = "Fold sharded view/download counters back into the Movie columns."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movie-id', type=int, help='Only fold counters of a specific movie id')
+
+    def handle(self, *args, **options):
+        movie_id = options.get('movie_id')
+        folded = counters.fold([movie_id] if movie_id else None)
+        self.stdout.write(self.style.SUCCESS(f"Done. Movies updated: {folded}"))
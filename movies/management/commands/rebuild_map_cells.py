@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from movies.utils import mapcells
+
+
+class Command(BaseCommand):
+    help = "Recount the pre-aggregated visitor map cells (VisitorMapCell) from the Visitor table."
+
+    def handle(self, *args, **options):
+        cells = mapcells.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Done. Map cells: {cells}"))
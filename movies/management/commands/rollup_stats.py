@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from movies.utils import rollups
+
+
+class Command(BaseCommand):
+    help = "Fold new watch/download rows into the hourly and daily movie stats rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every day instead of only what changed since the last run')
+
+    def handle(self, *args, **options):
+        rebuilt = rollups.rollup_movie_stats(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Done. Movie-days rebuilt: {rebuilt}"))
@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+
+from movies.models import Movie
+from movies.utils import transcode
+
+
+class Command(BaseCommand):
+    help = "Run queued video conversions (TranscodeJob). Several workers can run side by side."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=getattr(settings, 'TRANSCODE_CONCURRENCY', 1),
+                            help='Conversions this worker runs at once')
+        parser.add_argument('--poll', type=float, default=getattr(settings, 'TRANSCODE_POLL_SECONDS', 5),
+                            help='Seconds between checks for new jobs')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due')
+        parser.add_argument('--enqueue-missing', action='store_true',
+                            help='First queue every movie with an uploaded video but no converted file or HLS ladder')
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        worker = transcode.worker_name()
+
+        if options['enqueue_missing']:
+            missing = Movie.objects.filter(video_url__contains=settings.MEDIA_URL).filter(
+                Q(converted_video='') | Q(converted_video__isnull=True) | Q(hls_playlist=''))
+            queued = sum(transcode.enqueue(m) for m in missing.iterator() if transcode.uploaded_source(m))
+            self.stdout.write(f"Queued {queued} movies")
+
+        self.stdout.write(f"Transcode worker {worker} started (concurrency {concurrency})")
+        renew_every = transcode.lease_seconds() / 3
+        last_renew = time.monotonic()
+        running = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            try:
+                while True:
+                    close_old_connections()
+                    if time.monotonic() - last_renew >= renew_every:
+                        transcode.renew(worker)
+                        last_renew = time.monotonic()
+
+                    for job in transcode.claim(worker, concurrency - len(running)):
+                        self.stdout.write(f"Job {job.id}: movie {job.movie_id} '{job.movie.name}' (attempt {job.attempts})")
+                        running[pool.submit(transcode.run_job, job, worker)] = job
+
+                    if not running and options['once']:
+                        break
+                    done, _ = wait(list(running), timeout=options['poll'], return_when=FIRST_COMPLETED)
+                    if not running:
+                        time.sleep(options['poll'])
+                    for future in done:
+                        job = running.pop(future)
+                        ok = future.result()
+                        self.stdout.write((self.style.SUCCESS if ok else self.style.WARNING)(
+                            f"Job {job.id}: {'done' if ok else 'failed'}"))
+            except KeyboardInterrupt:
+                self.stdout.write(f"Stopping; waiting for {len(running)} running jobs")
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_comment_count(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    Comment = apps.get_model('movies', 'Comment')
+    counts = (
+        Comment.objects.filter(movie=OuterRef('pk'))
+        .order_by()
+        .values('movie')
+        .annotate(cnt=Count('id'))
+        .values('cnt')
+    )
+    Movie.objects.update(comment_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0016_movie_converted_video'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_comment_count, migrations.RunPython.noop),
+    ]
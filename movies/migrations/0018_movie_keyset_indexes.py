@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0017_movie_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='movie_new_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-download_count', '-uploaded_at', '-id'], name='movie_trending_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Search indexes for movies.utils.search (PostgreSQL only; no-op elsewhere)
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Keep in sync with movies.utils.search.SEARCH_DOCUMENT_SQL
+SEARCH_DOCUMENT_SQL = (
+    "to_tsvector('simple', coalesce(name, '') || ' ' || "
+    "coalesce(description, '') || ' ' || coalesce(genre, ''))"
+)
+
+FORWARD_SQL = [
+    "CREATE INDEX IF NOT EXISTS movie_name_trgm_idx ON movies_movie USING gin (name gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS movie_search_document_idx ON movies_movie USING gin (({SEARCH_DOCUMENT_SQL}))",
+]
+REVERSE_SQL = [
+    "DROP INDEX IF EXISTS movie_search_document_idx",
+    "DROP INDEX IF EXISTS movie_name_trgm_idx",
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in FORWARD_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in REVERSE_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0018_movie_keyset_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
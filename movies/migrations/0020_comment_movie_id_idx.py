@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0019_movie_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['movie', 'id'], name='comment_movie_id_idx'),
+        ),
+    ]
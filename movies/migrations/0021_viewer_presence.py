@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0020_comment_movie_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewerPresence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('viewer', models.CharField(max_length=64)),
+                ('last_seen', models.DateTimeField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presence', to='movies.movie')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['movie', 'last_seen'], name='presence_movie_seen_idx'), models.Index(fields=['last_seen'], name='presence_seen_idx')],
+                'constraints': [models.UniqueConstraint(fields=('movie', 'viewer'), name='presence_movie_viewer_uniq')],
+            },
+        ),
+    ]
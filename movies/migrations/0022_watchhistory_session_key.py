@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0021_viewer_presence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='watchhistory',
+            name='session_key',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
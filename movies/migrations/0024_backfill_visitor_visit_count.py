@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:40
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def populate_visit_count(apps, schema_editor):
+    """visit_count used to stay at 1; one visit per recorded play from that address."""
+    Visitor = apps.get_model('movies', 'Visitor')
+    WatchHistory = apps.get_model('movies', 'WatchHistory')
+    plays = (
+        WatchHistory.objects.filter(ip_address=OuterRef('ip_address'))
+        .order_by()
+        .values('ip_address')
+        .annotate(cnt=Count('id'))
+        .values('cnt')
+    )
+    Visitor.objects.update(visit_count=Greatest(Coalesce(Subquery(plays), 0), Value(1)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0023_movie_counter_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_visit_count, migrations.RunPython.noop),
+    ]
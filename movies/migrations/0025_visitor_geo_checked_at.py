@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:47
+
+from django.db import migrations, models
+from django.db.models import F, Q
+
+
+def mark_located_visitors(apps, schema_editor):
+    """Visitors that already have a location don't need another lookup."""
+    Visitor = apps.get_model('movies', 'Visitor')
+    Visitor.objects.exclude(country='').update(geo_checked_at=F('last_visit'))
+    Visitor.objects.filter(Q(country=''), ~Q(lat=0) | ~Q(lng=0)).update(geo_checked_at=F('last_visit'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0024_backfill_visitor_visit_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visitor',
+            name='geo_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='visitor',
+            index=models.Index(fields=['geo_checked_at'], name='visitor_geo_checked_idx'),
+        ),
+        migrations.RunPython(mark_located_visitors, migrations.RunPython.noop),
+    ]
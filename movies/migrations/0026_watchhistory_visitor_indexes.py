@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0025_visitor_geo_checked_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='watchhistory',
+            index=models.Index(fields=['ip_address', 'start_time'], name='watch_ip_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watchhistory',
+            index=models.Index(condition=models.Q(('end_time__isnull', True)), fields=['start_time'], name='watch_open_start_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-16 22:50
+
+from django.db import migrations, models
+
+# frozen copy of movies.utils.geohash.encode, so later edits to the app cannot change this migration
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode(lat, lng, precision=9):
+    if lat is None or lng is None or (not lat and not lng):
+        return ""
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return ""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def populate_geohash(apps, schema_editor):
+    Visitor = apps.get_model('movies', 'Visitor')
+    batch = []
+    for visitor in Visitor.objects.exclude(lat=0, lng=0).only('id', 'lat', 'lng').iterator(chunk_size=2000):
+        visitor.geohash = encode(visitor.lat, visitor.lng)
+        batch.append(visitor)
+        if len(batch) >= 2000:
+            Visitor.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        Visitor.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0026_watchhistory_visitor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visitor',
+            name='geohash',
+            field=models.CharField(blank=True, default='', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='visitor',
+            index=models.Index(fields=['lat', 'lng'], name='visitor_lat_lng_idx'),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
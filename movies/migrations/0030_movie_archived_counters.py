@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0029_movie_stats_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='archived_downloads',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='archived_views',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0031_transcode_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='hls_playlist',
+            field=models.CharField(blank=True, default='', editable=False, max_length=500),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0032_movie_hls_playlist'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='audio_codec',
+            field=models.CharField(blank=True, default='', editable=False, max_length=30),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='bitrate_kbps',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='duration_seconds',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='video_codec',
+            field=models.CharField(blank=True, default='', editable=False, max_length=30),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='video_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='video_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0033_movie_media_probe'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-16 23:29
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+# frozen copies of movies.utils.mapcells / movies.utils.geohash at this migration
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+CELL_PRECISIONS = (2, 3, 4, 5, 6, 7)
+
+
+def decode(geohash):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2
+
+
+def populate_cells(apps, schema_editor):
+    Visitor = apps.get_model('movies', 'Visitor')
+    VisitorMapCell = apps.get_model('movies', 'VisitorMapCell')
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    located = Visitor.objects.exclude(geohash='').values_list('geohash', 'lat', 'lng').order_by()
+    for geohash, lat, lng in located.iterator(chunk_size=2000):
+        for precision in CELL_PRECISIONS:
+            total = totals[(precision, geohash[:precision])]
+            total[0] += 1
+            total[1] += lat
+            total[2] += lng
+    cells = []
+    for (precision, cell), (visitors, lat_sum, lng_sum) in totals.items():
+        lat, lng = decode(cell)
+        cells.append(VisitorMapCell(precision=precision, cell=cell, lat=lat, lng=lng,
+                                    visitors=visitors, lat_sum=lat_sum, lng_sum=lng_sum))
+    VisitorMapCell.objects.bulk_create(cells, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0035_movie_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitorMapCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('precision', models.PositiveSmallIntegerField()),
+                ('cell', models.CharField(max_length=12)),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('visitors', models.IntegerField(default=0)),
+                ('lat_sum', models.FloatField(default=0.0)),
+                ('lng_sum', models.FloatField(default=0.0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['precision', 'lat', 'lng'], name='visitor_map_cell_bbox_idx')],
+                'constraints': [models.UniqueConstraint(fields=('precision', 'cell'), name='visitor_map_cell_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_cells, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,7 @@
-from datetime import timedelta
 from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
 from django.db import models
 from django.utils import timezone
-import os
-from moviepy.editor import VideoFileClip
 from django.conf import settings
 
 
@@ -37,51 +35,121 @@ class Movie(models.Model):
     # Counters
     total_views = models.PositiveIntegerField(default=0)
     download_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    # history rows moved to archive files (movies/utils/archive.py), kept in the totals
+    archived_views = models.PositiveIntegerField(default=0, editable=False)
+    archived_downloads = models.PositiveIntegerField(default=0, editable=False)
     genre = models.CharField(max_length=100, blank=True, null=True)
 
     # New field for converted video
     converted_video = models.FileField(upload_to='converted_movies/', blank=True, null=True)
+    # what the transcode probe found in video_url (movies/utils/transcode.py)
+    video_codec = models.CharField(max_length=30, blank=True, default="", editable=False)
+    audio_codec = models.CharField(max_length=30, blank=True, default="", editable=False)
+    video_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    video_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    duration_seconds = models.FloatField(null=True, blank=True, editable=False)
+    bitrate_kbps = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # HLS master playlist, relative to MEDIA_ROOT (movies/utils/transcode.py)
+    hls_playlist = models.CharField(max_length=500, blank=True, default="", editable=False)
+    # state of the latest TranscodeJob; "" = nothing to convert
+    TRANSCODE_STATUS_CHOICES = [
+        ("", "—"),
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+    transcode_status = models.CharField(max_length=10, choices=TRANSCODE_STATUS_CHOICES, blank=True, default="",
+                                        editable=False)
 
     class Meta:
         ordering = ["-uploaded_at"]
         indexes = [
             models.Index(fields=["uploaded_at"]),
             models.Index(fields=["name"]),
+            # Keyset pagination: "new" and "trending" catalog sorts
+            models.Index(fields=["-uploaded_at", "-id"], name="movie_new_keyset_idx"),
+            models.Index(fields=["-download_count", "-uploaded_at", "-id"], name="movie_trending_keyset_idx"),
         ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def hls_url(self):
+        """The HLS ladder's master playlist, "" until there is one that browsers can reach (MEDIA_SERVED)."""
+        if not (self.hls_playlist and getattr(settings, "MEDIA_SERVED", settings.DEBUG)):
+            return ""
+        return settings.MEDIA_URL + self.hls_playlist
+
+    @property
+    def playback_url(self):
+        """
+        Progressive MP4 for players without HLS: the converted file once there
+        is one that browsers can reach, else `video_url`. Files in a local
+        MEDIA_ROOT are only reachable with MEDIA_SERVED; other storages
+        (object storage through STORAGES) hand out their own URLs.
+        """
+        if self.converted_video and (getattr(settings, "MEDIA_SERVED", settings.DEBUG)
+                                     or not isinstance(self.converted_video.storage, FileSystemStorage)):
+            return self.converted_video.url
+        return self.video_url
+
     def save(self, *args, **kwargs):
         """
-        Override save method to automatically convert the uploaded video
-        into a universal format (MP4 + AAC audio).
+        Saving returns right away: a movie with an uploaded video but no
+        converted files gets a TranscodeJob, run by
+        `manage.py run_transcode_worker` (movies/utils/transcode.py).
         """
         super().save(*args, **kwargs)
 
-        # Convert only if video_url is set and converted_video not yet created
-        if self.video_url and not self.converted_video:
-            try:
-                input_path = os.path.join(settings.MEDIA_ROOT, self.video_url.replace(settings.MEDIA_URL, ''))
-                base, _ = os.path.splitext(input_path)
-                output_path = base + "_converted.mp4"
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and not {"video_url", "converted_video", "hls_playlist"} & set(update_fields):
+            return
+        if self.video_url and not (self.converted_video and self.hls_playlist):
+            from movies.utils.transcode import enqueue, uploaded_source
+            if uploaded_source(self):
+                enqueue(self)
+
+# ===============================
+# Transcode job queue
+# ===============================
+class TranscodeJob(models.Model):
+    """
+    One conversion of a movie's video, claimed by `run_transcode_worker`
+    with a conditional UPDATE (movies/utils/transcode.py).
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name="transcode_jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default="")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
 
-                clip = VideoFileClip(input_path)
-                clip.write_videofile(
-                    output_path,
-                    codec='libx264',
-                    audio_codec='aac',
-                    temp_audiofile='temp-audio.m4a',
-                    remove_temp=True
-                )
-                clip.close()
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            # at most one queued or running job per movie
+            models.UniqueConstraint(fields=["movie"], condition=models.Q(status__in=["pending", "running"]),
+                                    name="transcode_one_active_job"),
+        ]
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="transcode_due_idx"),
+        ]
 
-                relative_path = os.path.relpath(output_path, settings.MEDIA_ROOT)
-                self.converted_video.name = relative_path
-                super().save(update_fields=['converted_video'])
+    def __str__(self):
+        return f"{self.movie_id} {self.status} (attempt {self.attempts})"
 
-            except Exception as e:
-                print(f"⚠️ Video conversion failed: {e}")
 
 # ===============================
 # Comment model
@@ -97,6 +165,8 @@ class Comment(models.Model):
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["created_at"]),
+            # Cursor pagination of a movie's comments on id
+            models.Index(fields=["movie", "id"], name="comment_movie_id_idx"),
         ]
 
     def display_name(self) -> str:
@@ -115,6 +185,8 @@ class WatchHistory(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name="watch_history")
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     ip_address = models.GenericIPAddressField()
+    # handed to the player before the row exists (rows are written in batches)
+    session_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
 
     start_time = models.DateTimeField(null=True, blank=True)
     end_time = models.DateTimeField(null=True, blank=True)
@@ -126,19 +198,89 @@ class WatchHistory(models.Model):
         ordering = ["-last_seen"]
         indexes = [
             models.Index(fields=["last_seen"]),
+            models.Index(fields=["start_time"], name="watch_start_idx"),
+            models.Index(fields=["ip_address", "start_time"], name="watch_ip_start_idx"),
+            models.Index(
+                fields=["start_time"],
+                condition=models.Q(end_time__isnull=True),
+                name="watch_open_start_idx",
+            ),
         ]
 
     def __str__(self):
         return f"{self.user.username if self.user else self.ip_address} - {self.movie.name}"
 
     @staticmethod
-    def active_viewers(movie, window_seconds=60):
+    def active_viewers(movie):
         """
-        Count how many people are actively watching this movie.
-        Anyone with a last_seen in the last `window_seconds` is considered live.
+        Count how many people are actively watching this movie, i.e. whose
+        player sent a heartbeat within PRESENCE_WINDOW_SECONDS.
         """
-        cutoff = timezone.now() - timedelta(seconds=window_seconds)
-        return WatchHistory.objects.filter(movie=movie, last_seen__gte=cutoff).count()
+        from movies.utils.presence import live_count
+        return live_count(getattr(movie, "pk", movie))
+
+
+# ===============================
+# Sharded Movie counters
+# ===============================
+class MovieCounterShard(models.Model):
+    """
+    One slot of a sharded Movie counter; slots are summed back into the
+    Movie column periodically (see movies/utils/counters.py).
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name="counter_shards")
+    field = models.CharField(max_length=32)
+    slot = models.PositiveSmallIntegerField()
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["movie", "field", "slot"], name="counter_shard_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.movie_id}.{self.field}[{self.slot}] = {self.value}"
+
+
+# ===============================
+# Movie change log (autocomplete deltas)
+# ===============================
+class MovieChange(models.Model):
+    """
+    A movie saved or deleted, written by the Movie signals so every worker
+    can patch its in-process title index (movies/utils/autocomplete.py).
+    No foreign key: rows outlive the movie they describe.
+    """
+    movie_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.movie_id} @ {self.changed_at}"
+
+
+# ===============================
+# Viewer presence (live viewers)
+# ===============================
+class ViewerPresence(models.Model):
+    """
+    One row per player currently sending heartbeats; rows older than the
+    presence window are swept (see movies/utils/presence.py).
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name="presence")
+    viewer = models.CharField(max_length=64)
+    last_seen = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["movie", "viewer"], name="presence_movie_viewer_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["movie", "last_seen"], name="presence_movie_seen_idx"),
+            models.Index(fields=["last_seen"], name="presence_seen_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.viewer} @ {self.movie_id}"
 
 
 # ===============================
@@ -176,10 +318,17 @@ class Visitor(models.Model):
     known = models.BooleanField(default=False)
     visit_count = models.PositiveIntegerField(default=1)
 
+    # set once a GeoIP lookup ran (even an unsuccessful one); NULL = not resolved yet
+    geo_checked_at = models.DateTimeField(null=True, blank=True)
+    # geohash of (lat, lng), kept in sync on save; "" = no location (see movies/utils/geohash.py)
+    geohash = models.CharField(max_length=12, blank=True, default="")
+
     class Meta:
         ordering = ["-last_visit"]
         indexes = [
             models.Index(fields=["last_visit"]),
+            models.Index(fields=["geo_checked_at"], name="visitor_geo_checked_idx"),
+            models.Index(fields=["lat", "lng"], name="visitor_lat_lng_idx"),
         ]
 
     def __str__(self):
@@ -191,3 +340,89 @@ class Visitor(models.Model):
         Visitor is considered online if seen within last 5 minutes.
         """
         return (timezone.now() - self.last_visit).total_seconds() < 300
+
+
+class VisitorMapCell(models.Model):
+    """
+    Located visitors per geohash prefix, one row per (precision, cell), so
+    the dashboard map reads counts instead of grouping every visitor
+    (movies/utils/mapcells.py). lat/lng is the cell center, for bbox filters.
+    """
+    precision = models.PositiveSmallIntegerField()
+    cell = models.CharField(max_length=12)
+    lat = models.FloatField()
+    lng = models.FloatField()
+    visitors = models.IntegerField(default=0)
+    lat_sum = models.FloatField(default=0.0)
+    lng_sum = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["precision", "cell"], name="visitor_map_cell_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["precision", "lat", "lng"], name="visitor_map_cell_bbox_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.cell}: {self.visitors} visitors"
+
+
+# ===============================
+# Dashboard rollups
+# ===============================
+class DailyVisitStats(models.Model):
+    """
+    Site-wide plays and distinct visitors per calendar day (in
+    DASHBOARD_TIME_ZONE), filled from WatchHistory by movies/utils/rollups.py.
+    """
+    day = models.DateField(unique=True)
+    visits = models.PositiveIntegerField(default=0)
+    visitors = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-day"]
+
+    def __str__(self):
+        return f"{self.day}: {self.visits} visits, {self.visitors} visitors"
+
+
+class MovieStatsRollup(models.Model):
+    """
+    Per-movie activity per hour or per day (bucket = local start of the
+    period). Rebuilt a whole movie-day at a time by `rollup_stats`.
+    """
+    HOUR = "hour"
+    DAY = "day"
+    PERIOD_CHOICES = [(HOUR, "Hour"), (DAY, "Day")]
+
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name="stats_rollups")
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField()
+    plays = models.PositiveIntegerField(default=0)
+    downloads = models.PositiveIntegerField(default=0)
+    watch_seconds = models.PositiveBigIntegerField(default=0)
+    unique_ips = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-bucket"]
+        constraints = [
+            models.UniqueConstraint(fields=["movie", "period", "bucket"], name="movie_rollup_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["period", "bucket"], name="movie_rollup_bucket_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.movie_id} {self.period} {self.bucket:%Y-%m-%d %H:%M}: {self.plays} plays"
+
+
+class RollupCheckpoint(models.Model):
+    """High-water mark of raw rows already folded into a rollup."""
+    name = models.CharField(max_length=50, unique=True)
+    high_water = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.high_water}"
@@ -0,0 +1,99 @@
+# movies/signals.py
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Comment, Movie, MovieChange, Visitor
+from .utils.autocomplete import title_index
+from .utils.cache import COMMENTS_VERSION, MOVIES_VERSION, bump_version
+from .utils.events import hub
+from .utils.geohash import encode as geohash_encode
+from .utils.mapcells import NO_LOCATION, location_of, record_moves
+
+
+# ============================================================
+# Denormalized comment counter
+# ============================================================
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    """Keep Movie.comment_count in step with new comments."""
+    if created and not raw:
+        Movie.objects.filter(id=instance.movie_id).update(comment_count=F("comment_count") + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    """Decrement Movie.comment_count, never going below zero."""
+    Movie.objects.filter(id=instance.movie_id, comment_count__gt=0).update(comment_count=F("comment_count") - 1)
+
+
+# ============================================================
+# Autocomplete prefix index
+# ============================================================
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, raw=False, **kwargs):
+    """Patch this worker's index; other workers replay the MovieChange row."""
+    if not raw:
+        MovieChange.objects.create(movie_id=instance.id)
+        movie_id, name, popularity = instance.id, instance.name, instance.download_count
+        transaction.on_commit(lambda: title_index.upsert(movie_id, name, popularity))
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted(sender, instance, **kwargs):
+    MovieChange.objects.create(movie_id=instance.id)
+    movie_id = instance.id
+    transaction.on_commit(lambda: title_index.remove(movie_id))
+
+
+# ============================================================
+# Catalog cache invalidation
+# ============================================================
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def movies_changed(sender, **kwargs):
+    # after commit, so nothing rebuilt from the new version can miss the change
+    transaction.on_commit(lambda: bump_version(MOVIES_VERSION))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comments_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(COMMENTS_VERSION))
+
+
+# ============================================================
+# Live event stream (watch page)
+# ============================================================
+@receiver(post_save, sender=Comment)
+def comment_published(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        hub.notify(instance.movie_id)
+
+
+# ============================================================
+# Visitor map cells
+# ============================================================
+@receiver(pre_save, sender=Visitor)
+def visitor_geohash(sender, instance, **kwargs):
+    """
+    Keep Visitor.geohash in step with lat/lng (admin edits, plain saves) and
+    remember the stored location, so `visitor_moved` can move the visitor
+    between map cells.
+    """
+    instance.geohash = geohash_encode(instance.lat, instance.lng)
+    before = None
+    if instance.pk:
+        before = Visitor.objects.filter(pk=instance.pk).values_list("geohash", "lat", "lng").first()
+    instance._map_location = before if before and before[0] else NO_LOCATION
+
+
+@receiver(post_save, sender=Visitor)
+def visitor_moved(sender, instance, **kwargs):
+    record_moves([(getattr(instance, "_map_location", NO_LOCATION), location_of(instance))])
+
+
+@receiver(post_delete, sender=Visitor)
+def visitor_deleted(sender, instance, **kwargs):
+    record_moves([(location_of(instance), NO_LOCATION)])
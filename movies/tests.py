@@ -1,3 +1,595 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (Comment, DownloadHistory, Movie, RollupCheckpoint, TranscodeJob, Visitor, VisitorMapCell,
+                     WatchHistory)
+from .utils import archive, cache as catalog_cache, counters, mapcells, rollups, transcode
+from .utils import enrichment
+from .utils.enrichment import GeoEnrichmentQueue, save_locations
+from .utils import autocomplete
+from .utils.autocomplete import MAX_PER_TOKEN, PrefixIndex
+from .utils.ingest import WatchEventBuffer, new_session_key, watch_events
+from .utils.pagination import CATALOG_SORTS, _after, decode_cursor, encode_cursor, keyset_page
+from .utils.search import search_movies
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+# ===============================
+# Denormalized comment counter
+# ===============================
+class CommentCountTests(TestCase):
+    def setUp(self):
+        self.movie = Movie.objects.create(name="Umurage")
+
+    def test_signals_keep_count_in_step(self):
+        comments = [Comment.objects.create(movie=self.movie, text=f"c{i}") for i in range(3)]
+        comments[0].delete()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.comment_count, 2)
+
+    def test_admin_form_cannot_write_count(self):
+        Comment.objects.create(movie=self.movie, text="hi")
+        self.client.force_login(User.objects.create_superuser("admin", "a@example.com", "pw"))
+        url = reverse("admin:movies_movie_change", args=[self.movie.id])
+        response = self.client.post(url, {"name": "Umurage", "description": "edited", "comment_count": 0,
+                                          "total_views": 0, "download_count": 0})
+        self.assertEqual(response.status_code, 302)
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.description, self.movie.comment_count), ("edited", 1))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CommentCountsApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = Movie.objects.create(name="Umurage")
+
+    def poll(self, version=""):
+        url = reverse("movies:comment_counts_api")
+        return self.client.get(url, {"ids": str(self.movie.id), "version": version}).json()
+
+    def test_unchanged_version_skips_queries(self):
+        first = self.poll()
+        self.assertEqual(first["counts"], {str(self.movie.id): 0})
+        with self.assertNumQueries(0):
+            again = self.poll(first["version"])
+        self.assertFalse(again["changed"])
+
+    def test_new_comment_changes_version(self):
+        first = self.poll()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(movie=self.movie, text="hi")
+        second = self.poll(first["version"])
+        self.assertTrue(second["changed"])
+        self.assertEqual(second["counts"], {str(self.movie.id): 1})
+
+    def test_version_changes_only_after_commit(self):
+        first = self.poll()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Comment.objects.create(movie=self.movie, text="hi")
+            # a poll before the commit must not cache its counts under a new version
+            self.assertEqual(str(catalog_cache.get_version(catalog_cache.COMMENTS_VERSION)), first["version"])
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(str(catalog_cache.get_version(catalog_cache.COMMENTS_VERSION)), first["version"])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.kigali = Movie.objects.create(name="Été à Kigali 6")
+        Movie.objects.create(name="Umurage")
+
+    def search(self, q):
+        return list(search_movies(Movie.objects.all(), q).values_list("name", flat=True))
+
+    def test_typo_in_one_word_of_a_title(self):
+        self.assertEqual(self.search("kigalo"), ["Été à Kigali 6"])
+        self.assertEqual(self.search("ete kigalo"), ["Été à Kigali 6"])
+
+    def test_no_close_word(self):
+        self.assertEqual(self.search("zzzzqx"), [])
+
+
+class PrefixIndexTests(TestCase):
+    def test_other_workers_apply_logged_changes_without_reloading(self):
+        kept = Movie.objects.create(name="Amahoro")
+        gone = Movie.objects.create(name="Amakuru")
+        index = PrefixIndex()
+        index.ensure_loaded(version=1)
+
+        Movie.objects.create(name="Amarira")
+        kept.name = "Amahoro Mashya"
+        kept.save()
+        gone.delete()
+        with mock.patch.object(index, "load_from_db", side_effect=AssertionError("full reload")):
+            index.ensure_loaded(version=2)
+        self.assertEqual([name for _, name in index.suggest("ama")], ["Amahoro Mashya", "Amarira"])
+
+    def test_expired_index_reloads_in_the_background(self):
+        Movie.objects.create(name="Amahoro")
+        index = PrefixIndex()
+        index.ensure_loaded(version=1)
+        index._loaded_at -= autocomplete._refresh_seconds() + 1
+        with mock.patch.object(autocomplete.threading, "Thread") as thread, \
+                mock.patch.object(index, "load_from_db", side_effect=AssertionError("reload in the request")):
+            index.ensure_loaded(version=1)
+        thread.assert_called_once_with(target=index._background_reload, name="autocomplete-reload", daemon=True)
+        thread.return_value.start.assert_called_once_with()
+        self.assertEqual([name for _, name in index.suggest("ama")], ["Amahoro"])  # still served meanwhile
+
+        with mock.patch.object(index, "build", wraps=index.build) as build:
+            index._background_reload()
+        build.assert_called_once()
+        Movie.objects.create(name="Amarira")  # committed after the reload read the table, before the swap
+        with mock.patch.object(index, "load_from_db", side_effect=AssertionError("full reload")):
+            index.ensure_loaded(version=1)  # same version, but the swap asks for a replay
+        self.assertEqual([name for _, name in index.suggest("ama")], ["Amahoro", "Amarira"])
+
+    def test_upsert_keeps_postings_by_popularity(self):
+        index = PrefixIndex()
+        index.build((i, f"Kigali {i}", 100) for i in range(MAX_PER_TOKEN * 2))
+        index.upsert(1000, "Kigali Nshya", 5000)
+        index.upsert(5, "Kigali 5", 9000)
+        self.assertEqual([movie_id for movie_id, _ in index.suggest("kigali", 2)], [5, 1000])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_invalidates_entries(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            return len(builds)
+
+        self.assertEqual(catalog_cache.get_or_refresh("k", build), 1)
+        self.assertEqual(catalog_cache.get_or_refresh("k", build), 1)
+        catalog_cache.bump_version(catalog_cache.MOVIES_VERSION)
+        self.assertEqual(catalog_cache.get_or_refresh("k", build), 2)
+
+    def test_bumps_never_reuse_a_version(self):
+        seen = {catalog_cache.get_version(catalog_cache.MOVIES_VERSION)}
+        for _ in range(50):
+            seen.add(catalog_cache.bump_version(catalog_cache.MOVIES_VERSION))
+        self.assertEqual(len(seen), 51)
+
+    def test_stale_entry_served_while_another_request_rebuilds(self):
+        catalog_cache.get_or_refresh("k", lambda: "old")
+        catalog_cache.bump_version(catalog_cache.COMMENTS_VERSION)
+        cache.add("k:lock", 1)
+        self.assertEqual(catalog_cache.get_or_refresh("k", lambda: "new"), "old")
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class WatchEventBufferTests(TestCase):
+    def setUp(self):
+        self.movie = Movie.objects.create(name="Umurage")
+        self.buffer = WatchEventBuffer()
+        patcher = mock.patch.object(self.buffer, "_ensure_thread")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_invalid_address_rejected(self):
+        with self.assertRaises(ValueError):
+            self.buffer.start(new_session_key(), self.movie.id, "not-an-ip, 10.0.0.1")
+
+    def test_bad_event_does_not_wedge_the_buffer(self):
+        taken = new_session_key()
+        self.buffer.start(taken, self.movie.id, "10.0.0.1")
+        self.assertEqual(self.buffer.flush(), 1)
+
+        good = [new_session_key() for _ in range(3)]
+        self.buffer.start(good[0], self.movie.id, "10.0.0.2")
+        self.buffer.start(taken, self.movie.id, "10.0.0.3")  # duplicate session key
+        for key in good[1:]:
+            self.buffer.start(key, self.movie.id, "10.0.0.4")
+        with self.assertLogs("movies.utils.ingest", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer.dead_letters), 1)
+        self.assertEqual(WatchHistory.objects.filter(session_key__in=good).count(), 3)
+
+    def test_unreachable_database_requeues_the_batch(self):
+        key = new_session_key()
+        self.buffer.start(key, self.movie.id, "10.0.0.1")
+        with mock.patch.object(self.buffer, "_apply", side_effect=OperationalError("down")), \
+                self.assertLogs("movies.utils.ingest", "ERROR"):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertTrue(WatchHistory.objects.filter(session_key=key).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ShardedCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        counters._next_fold_check = 0.0
+        self.movie = Movie.objects.create(name="Umurage")
+
+    def test_fold_waits_for_the_callers_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for _ in range(5):
+                counters.increment(self.movie.id, "download_count")
+            self.movie.refresh_from_db()
+            self.assertEqual(self.movie.download_count, 0)
+        self.assertEqual(counters.pending(self.movie.id)["download_count"], 5)
+        for callback in callbacks:
+            callback()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.download_count, 5)
+        self.assertEqual(counters.pending(self.movie.id)["download_count"], 0)
+
+    def test_fold_is_not_double_counted(self):
+        counters.increment(self.movie.id, "total_views", 3)
+        counters.fold()
+        counters.increment(self.movie.id, "total_views", 2)
+        counters.fold()
+        counters.fold()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.total_views, 5)
+
+    def test_update_stats_leaves_unfolded_shards_to_the_fold(self):
+        with self.captureOnCommitCallbacks():
+            for _ in range(3):
+                WatchHistory.objects.create(movie=self.movie, ip_address="41.186.0.1", start_time=timezone.now())
+                counters.increment(self.movie.id, "total_views")
+        call_command("update_stats", stdout=StringIO())
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.total_views, 0)
+        counters.fold()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.total_views, 3)
+        call_command("update_stats", stdout=StringIO())
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.total_views, 3)
+
+
+class VisitorMapCellTests(TestCase):
+    KIGALI = ("Rwanda", "Kigali", -1.9441, 30.0619)
+    PARIS = ("France", "Paris", 48.8566, 2.3522)
+
+    def cells(self):
+        return set(VisitorMapCell.objects.filter(visitors__gt=0).values_list("precision", "cell", "visitors"))
+
+    def test_incremental_cells_match_a_rebuild(self):
+        visitors = [Visitor.objects.create(ip_address=f"41.186.0.{i}") for i in range(3)]
+        save_locations(visitors, {v.ip_address: self.KIGALI for v in visitors[:2]})
+        moved = Visitor.objects.get(id=visitors[1].id)
+        moved.lat, moved.lng = self.PARIS[2:]
+        moved.save()
+        visitors[0].delete()
+        incremental = self.cells()
+        self.assertEqual({(p, c, n) for p, c, n in incremental if p == 2}, {(2, "u0", 1)})
+        mapcells.rebuild()
+        self.assertEqual(self.cells(), incremental)
+
+    def test_two_queues_resolving_the_same_visitors_count_them_once(self):
+        visitors = [Visitor.objects.create(ip_address=f"41.186.0.{i}") for i in range(3)]
+        stale = list(Visitor.objects.all())  # as read by another process before the first one saved
+        queues = [GeoEnrichmentQueue(), GeoEnrichmentQueue()]
+        with mock.patch.object(enrichment.resolver, "locate_many",
+                               side_effect=lambda ips: {ip: self.KIGALI for ip in ips}):
+            for queue in queues:
+                queue._pending = {v.ip_address for v in visitors}
+            self.assertEqual([queue.process() for queue in queues], [3, 0])
+            save_locations(stale, {v.ip_address: self.KIGALI for v in stale})  # e.g. backfill_geoip
+        counted = self.cells()
+        self.assertIn((2, "kx", 3), counted)
+        mapcells.rebuild()
+        self.assertEqual(self.cells(), counted)
+
+    def test_clusters_read_cells_in_the_viewport(self):
+        visitors = [Visitor.objects.create(ip_address=f"41.186.0.{i}") for i in range(3)]
+        save_locations(visitors, {v.ip_address: (self.KIGALI if i < 2 else self.PARIS)
+                                  for i, v in enumerate(visitors)})
+        WatchHistory.objects.create(movie=Movie.objects.create(name="Umurage"), ip_address="41.186.0.0",
+                                    start_time=timezone.now())
+        url = reverse("movies:visitor_map_clusters")
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"bbox": "20,-10,40,10", "zoom": 3}).json()
+        self.assertEqual([(c["cell"], c["count"], c["online"]) for c in response["cells"]], [("kxt", 2, 1)])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class MovieStatsRollupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = Movie.objects.create(name="Umurage")
+        self.now = timezone.now()
+
+    def watch(self, days_ago, seconds=60, ip="10.0.0.1"):
+        started = self.now - timedelta(days=days_ago)
+        WatchHistory.objects.create(movie=self.movie, ip_address=ip, start_time=started,
+                                    end_time=started + timedelta(seconds=seconds), duration=timedelta(seconds=seconds))
+
+    def download(self, days_ago):
+        row = DownloadHistory.objects.create(movie=self.movie, ip_address="10.0.0.1")
+        DownloadHistory.objects.filter(id=row.id).update(downloaded_at=self.now - timedelta(days=days_ago))
+
+    def totals(self):
+        row = rollups.movie_stats_totals().get(movie_id=self.movie.id)
+        return row["plays"], row["downloads"], row["watch_seconds"]
+
+    def test_rerun_gives_the_same_result(self):
+        self.watch(3)
+        self.watch(3, ip="10.0.0.2")
+        self.watch(1)
+        self.download(1)
+        rollups.rollup_movie_stats()
+        first = self.totals()
+        rollups.rollup_movie_stats()
+        rollups.rollup_movie_stats(full=True)
+        self.assertEqual(self.totals(), first)
+        self.assertEqual(first, (3, 1, 180))
+
+    def test_late_rows_for_old_days_are_folded_in(self):
+        self.watch(3)
+        rollups.rollup_movie_stats()
+        self.watch(5)  # written now, about an older day
+        rollups.rollup_movie_stats()
+        self.assertEqual(self.totals(), (2, 0, 120))
+
+    def test_requests_never_run_the_rollup_themselves(self):
+        self.addCleanup(setattr, rollups, "_rollup_thread", None)
+        with mock.patch.object(rollups, "rollup_movie_stats") as run, \
+                mock.patch.object(rollups.threading, "Thread") as thread:
+            self.assertFalse(rollups.maybe_rollup())  # no checkpoint: the first build is rollup_stats' job
+            RollupCheckpoint.objects.create(name=rollups.MOVIE_STATS_CHECKPOINT, high_water=self.now)
+            self.assertTrue(rollups.maybe_rollup())
+            self.assertFalse(rollups.maybe_rollup())
+        run.assert_not_called()
+        thread.assert_called_once_with(target=rollups._background_rollup, name="stats-rollup", daemon=True)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class HistoryArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = Movie.objects.create(name="Umurage")
+        self.old = timezone.now() - timedelta(days=400)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def add_old_rows(self):
+        WatchHistory.objects.create(movie=self.movie, ip_address="10.0.0.1", start_time=self.old)
+        unstarted = WatchHistory.objects.create(movie=self.movie, ip_address="10.0.0.2")
+        WatchHistory.objects.filter(id=unstarted.id).update(last_seen=self.old)
+        download = DownloadHistory.objects.create(movie=self.movie, ip_address="10.0.0.1")
+        DownloadHistory.objects.filter(id=download.id).update(downloaded_at=self.old)
+
+    def totals(self):
+        call_command("update_stats", stdout=StringIO())
+        self.movie.refresh_from_db()
+        return self.movie.total_views, self.movie.download_count
+
+    def test_totals_stay_constant_and_reruns_add_part_files(self):
+        self.add_old_rows()
+        WatchHistory.objects.create(movie=self.movie, ip_address="10.0.0.3", start_time=timezone.now())
+        self.assertEqual(self.totals(), (3, 1))
+
+        archive.archive_expired(directory=self.directory)
+        self.assertEqual(WatchHistory.objects.count(), 1)
+        self.assertFalse(DownloadHistory.objects.exists())
+        self.assertEqual(self.totals(), (3, 1))
+        first = sorted(os.listdir(self.directory))
+        self.assertEqual(len(first), 2)
+        contents = {name: open(os.path.join(self.directory, name), "rb").read() for name in first}
+
+        self.add_old_rows()  # late rows for the archived month
+        archive.archive_expired(directory=self.directory)
+        self.assertEqual(self.totals(), (5, 2))
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(len(files), 4)
+        for name, data in contents.items():
+            self.assertEqual(open(os.path.join(self.directory, name), "rb").read(), data)
+        self.assertEqual(len(self.archived_ids("watchhistory")), 4)
+
+    def test_rerun_after_a_crash_never_archives_a_row_twice(self):
+        self.add_old_rows()
+        self.assertEqual(self.totals(), (2, 1))
+        with mock.patch.object(archive, "_drop", side_effect=OSError("killed")), self.assertRaises(OSError):
+            archive.archive_expired(fmt="csv", directory=self.directory)  # part file written, rows kept
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertEqual(WatchHistory.objects.count(), 2)
+
+        self.add_old_rows()  # late rows for the same month
+        archive.archive_expired(fmt="csv", directory=self.directory)
+        self.assertFalse(WatchHistory.objects.exists())
+        self.assertEqual(self.totals(), (4, 2))
+        ids = self.archived_ids("watchhistory")
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(len(set(ids)), 4)
+
+    def archived_ids(self, name):
+        ids = []
+        for part in sorted(n for n in os.listdir(self.directory) if n.startswith(name)):
+            ids += archive.part_ids(os.path.join(self.directory, part))
+        return ids
+
+
+class TranscodeQueueTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL="/media/",
+                                              TRANSCODE_MAX_ATTEMPTS=2, TRANSCODE_RETRY_SECONDS=60)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        with open(os.path.join(self.media_root, "umurage.mov"), "wb") as f:
+            f.write(b"\0")
+
+    def test_only_uploaded_videos_are_queued(self):
+        uploaded = Movie.objects.create(name="Umurage", video_url="https://vault.example/media/umurage.mov")
+        external = Movie.objects.create(name="Kigali", video_url="https://cdn.example/kigali.mp4")
+        missing = Movie.objects.create(name="Lost", video_url="https://vault.example/media/../secret.mov")
+        self.assertEqual(list(TranscodeJob.objects.values_list("movie_id", flat=True)), [uploaded.id])
+        self.assertEqual(external.transcode_status, "")
+        self.assertEqual(missing.transcode_status, "")
+
+    def test_claim_is_exclusive_and_failures_are_retried_then_failed(self):
+        movie = Movie.objects.create(name="Umurage", video_url="https://vault.example/media/umurage.mov")
+        [job] = transcode.claim("a")
+        self.assertEqual(transcode.claim("b"), [])
+
+        with mock.patch.object(transcode, "transcode_movie", side_effect=RuntimeError("boom")), \
+                self.assertLogs("movies.utils.transcode", "ERROR"):
+            self.assertFalse(transcode.run_job(job, "a"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.last_error), ("pending", 1, "RuntimeError: boom"))
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=50))
+        self.assertEqual(transcode.claim("b"), [])  # backing off
+
+        TranscodeJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        [job] = transcode.claim("b")
+        with mock.patch.object(transcode, "transcode_movie", side_effect=RuntimeError("boom")), \
+                self.assertLogs("movies.utils.transcode", "ERROR"):
+            transcode.run_job(job, "b")
+        job.refresh_from_db()
+        movie.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, movie.transcode_status), ("failed", 2, "failed"))
+
+    def test_expired_lease_is_taken_over(self):
+        movie = Movie.objects.create(name="Umurage", video_url="https://vault.example/media/umurage.mov")
+        [job] = transcode.claim("a")
+        self.assertEqual(transcode.claim("b"), [])
+        TranscodeJob.objects.filter(id=job.id).update(
+            locked_at=timezone.now() - timedelta(seconds=transcode.lease_seconds() + 1))
+        [taken] = transcode.claim("b")
+        self.assertEqual((taken.id, taken.locked_by, taken.attempts), (job.id, "b", 2))
+
+        with mock.patch.object(transcode, "transcode_movie"), self.assertLogs("movies.utils.transcode", "WARNING"):
+            transcode.run_job(job, "a")  # the old worker finishing late changes nothing
+        taken.refresh_from_db()
+        self.assertEqual(taken.status, "running")
+        with mock.patch.object(transcode, "transcode_movie"):
+            self.assertTrue(transcode.run_job(taken, "b"))
+        taken.refresh_from_db()
+        movie.refresh_from_db()
+        self.assertEqual((taken.status, movie.transcode_status), ("done", "done"))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PlaybackUrlTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.movie = Movie.objects.create(name="Umurage", video_url="https://cdn.example/umurage.mov")
+        Movie.objects.filter(id=self.movie.id).update(converted_video="converted_movies/umurage_converted.mp4",
+                                                      hls_playlist="converted_movies/umurage_hls/master.m3u8")
+        self.movie.refresh_from_db()
+
+    @override_settings(MEDIA_SERVED=False)
+    def test_unserved_media_falls_back_to_the_video_url(self):
+        self.assertEqual((self.movie.playback_url, self.movie.hls_url), ("https://cdn.example/umurage.mov", ""))
+        page = self.client.get(reverse("movies:watch_movie", args=[self.movie.id])).content.decode()
+        self.assertIn('<source src="https://cdn.example/umurage.mov" type="video/mp4">', page)
+        self.assertNotIn("umurage_converted.mp4", page)
+        self.assertNotIn("master.m3u8", page)
+
+    @override_settings(MEDIA_SERVED=True)
+    def test_served_media_plays_the_converted_files(self):
+        self.assertEqual(self.movie.playback_url, "/media/converted_movies/umurage_converted.mp4")
+        self.assertEqual(self.movie.hls_url, "/media/converted_movies/umurage_hls/master.m3u8")
+        page = self.client.get(reverse("movies:watch_movie", args=[self.movie.id])).content.decode()
+        self.assertIn('<source src="https://cdn.example/umurage.mov">', page)  # fallback after the MP4
+
+
+class KeysetPaginationTests(TestCase):
+    def test_every_row_exactly_once(self):
+        movies = Movie.objects.bulk_create([Movie(name=f"Film {i}") for i in range(23)])
+        moment = timezone.now()
+        for i, movie in enumerate(movies):
+            # ties on every sort column but the id
+            Movie.objects.filter(id=movie.id).update(uploaded_at=moment - timedelta(minutes=i % 3),
+                                                     download_count=i % 4)
+        for sort in CATALOG_SORTS:
+            with self.subTest(sort=sort):
+                seen, cursor = [], None
+                while True:
+                    page, cursor = keyset_page(Movie.objects.all(), sort, cursor, 5)
+                    seen += [m.id for m in page]
+                    if cursor is None:
+                        break
+                self.assertEqual(len(seen), len(movies))
+                self.assertEqual(set(seen), {m.id for m in movies})
+
+    def test_deep_pages_seek_into_the_index(self):
+        moment = timezone.now()
+        for i, movie in enumerate(Movie.objects.bulk_create([Movie(name=f"Film {i}") for i in range(1200)])):
+            Movie.objects.filter(id=movie.id).update(uploaded_at=moment - timedelta(minutes=i // 2))  # pairs tie
+        expected = list(Movie.objects.order_by("-uploaded_at", "-id").values_list("id", flat=True))
+        seen, cursor, pages = [], None, 0
+        while True:
+            page, next_cursor = keyset_page(Movie.objects.all(), "new", cursor, 25)
+            seen += [m.id for m in page]
+            pages += 1
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+        self.assertEqual((seen, pages), (expected, 48))
+
+        values = decode_cursor(cursor, CATALOG_SORTS["new"])  # the last page's cursor
+        plan = Movie.objects.order_by("-uploaded_at", "-id").filter(_after(CATALOG_SORTS["new"], values))[:26].explain()
+        self.assertIn("uploaded_at<", plan.replace(" ", ""))
+
+    def test_bad_cursor_starts_over(self):
+        Movie.objects.bulk_create([Movie(name=f"Film {i}") for i in range(3)])
+        first, _ = keyset_page(Movie.objects.all(), "new", None, 2)
+        for cursor in ("not-a-cursor", encode_cursor([1, 2, 3])):
+            self.assertEqual(keyset_page(Movie.objects.all(), "new", cursor, 2)[0], first)
+
+
+class CommentsFeedTests(TestCase):
+    def test_junk_cursors_read_the_newest_page(self):
+        movie = Movie.objects.create(name="Umurage")
+        Comment.objects.create(movie=movie, text="hi")
+        url = reverse("movies:comments_feed", args=[movie.id])
+        for params in ({"before": "abc"}, {"since": "1e3"}, {"since": "-4", "before": " "}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([c["text"] for c in response.json()["comments"]], ["hi"])
+
+
+class WatchSessionViewTests(TestCase):
+    def setUp(self):
+        self.movie = Movie.objects.create(name="Umurage")
+        patcher = mock.patch.object(watch_events, "_ensure_thread")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(watch_events.flush)
+
+    def post(self, name, *args):
+        return self.client.post(reverse(f"movies:{name}", args=args), REMOTE_ADDR="10.0.0.1")
+
+    def test_unknown_movie_is_not_found(self):
+        self.assertEqual(self.post("start_watch", self.movie.id + 1).status_code, 404)
+        self.assertEqual(watch_events.flush(), 0)
+
+    def test_stop_needs_a_known_session(self):
+        self.assertEqual(self.post("stop_watch", str(new_session_key())).status_code, 404)
+
+        pending = self.post("start_watch", self.movie.id).json()["watch_id"]
+        self.assertEqual(self.post("stop_watch", pending).json()["status"], "stopped")
+
+        flushed = self.post("start_watch", self.movie.id).json()["watch_id"]
+        watch_events.flush()
+        self.assertEqual(self.post("stop_watch", flushed).status_code, 200)
+        watch_events.flush()
+        self.assertIsNotNone(WatchHistory.objects.get(session_key=flushed).end_time)
+        self.assertEqual(self.post("stop_watch", flushed).json()["status"], "stopped")
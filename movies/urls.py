@@ -17,14 +17,17 @@ urlpatterns = [
     # Comments APIs
     # ============================
     path("watch/<int:movie_id>/comments/", views.comments_feed, name="comments_feed"),
+    path("watch/<int:movie_id>/events/", views.movie_events, name="movie_events"),
     path("comment_count/<int:movie_id>/", views.comment_count_api, name="comment_count_api"),
+    path("comment_counts/", views.comment_counts_api, name="comment_counts_api"),
 
     # ============================
     # Viewers / Watch History APIs
     # ============================
     path("watch/<int:movie_id>/viewers/", views.real_time_viewers, name="real_time_viewers"),
     path("watch/start/<int:movie_id>/", views.start_watch, name="start_watch"),
-    path("watch/stop/<int:watch_id>/", views.stop_watch, name="stop_watch"),
+    path("watch/stop/<str:watch_id>/", views.stop_watch, name="stop_watch"),
+    path("watch/<int:movie_id>/heartbeat/", views.watch_heartbeat, name="watch_heartbeat"),
 
     # ============================
     # Admin Dashboard
@@ -34,9 +37,13 @@ urlpatterns = [
     # Admin Dashboard Data APIs
     path("api/visitor-stats/", views.visitor_stats_api, name="visitor_stats_api"),
     path("api/visitor-chart/", views.visitor_chart_data, name="visitor_chart_data"),
+    path("api/movie-stats/", views.movie_stats_api, name="movie_stats_api"),
     path("api/visitor-country/", views.visitor_country_data, name="visitor_country_data"),
     path("api/visitor-map/", views.visitor_map_data, name="visitor_map_data"),
+    path("api/visitor-map/clusters/", views.visitor_map_clusters, name="visitor_map_clusters"),
+    path("api/export/<str:kind>/", views.export_history, name="export_history"),
     path('search_suggestions/', views.search_suggestions, name='search_suggestions'),
     path('latest/', views.latest_movies, name='latest_movies'),
+    path('api/catalog/', views.catalog_api, name='catalog_api'),
 
 ]
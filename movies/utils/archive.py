@@ -0,0 +1,220 @@
+# movies/utils/archive.py
+"""
+Month partitions and retention for the history tables.
+
+WatchHistory and DownloadHistory are split into calendar months (in
+DASHBOARD_TIME_ZONE) on their time columns, which are indexed, so a month is
+a range scan. Only the last HISTORY_RETENTION_MONTHS months (default 6, the
+current one included) stay in the database. Older months are:
+
+  1. folded into the rollups, which the dashboards read
+     (movies/utils/rollups.py), so their charts keep working
+  2. streamed in id order to a gzip part file under HISTORY_ARCHIVE_DIR,
+     named after the table, month and the first and last id it holds
+     (watchhistory-2024-01-1200-1234567.ndjson.gz), as NDJSON (default) or
+     CSV, written to a temp file and linked into place; an existing file is
+     never replaced
+  3. counted into Movie.archived_views / archived_downloads and deleted in a
+     single transaction, so the totals `update_stats` recomputes never change
+
+Each step can be rerun. Rows of an archived month that arrive late get a
+part file of their own on the next run. A run stopped between writing and
+deleting leaves rows behind that a part file already holds: the next run
+reads their ids back from the part files and only drops them, so no row is
+ever in two files. Deletes only cover the ids streamed.
+
+Watch rows without a start_time (sessions whose start was never
+recorded) are filed under the month of their last_seen.
+
+This is the PostgreSQL-and-SQLite equivalent of declarative partitions:
+hot queries filter on the same time columns and only see recent months.
+"""
+import csv
+import gzip
+import json
+import os
+import re
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q
+
+from movies.utils.exports import EXPORT_CHUNK, FORMATS, export_sources, iter_export
+from movies.utils.rollups import dashboard_tz, day_start, local_today, rollup_movie_stats, store_daily_visits
+
+
+def history_tables():
+    """
+    (name, model, time column, Movie counter, exported fields, fallback
+    column for rows whose time column is NULL) per archived table.
+    """
+    sources = export_sources()
+    watch, downloads = sources["watch"], sources["downloads"]
+    return (
+        ("watchhistory", watch[0], watch[1], "archived_views", watch[2], "last_seen"),
+        ("downloadhistory", downloads[0], downloads[1], "archived_downloads", downloads[2], None),
+    )
+
+
+def in_period(column, fallback=None, start=None, end=None):
+    """Q for rows whose `column` (or `fallback` where it is NULL) lies in [start, end)."""
+    def bounds(field):
+        q = Q()
+        if start is not None:
+            q &= Q(**{f"{field}__gte": start})
+        if end is not None:
+            q &= Q(**{f"{field}__lt": end})
+        return q
+
+    q = Q(**{f"{column}__isnull": False}) & bounds(column)
+    if fallback:
+        q |= Q(**{f"{column}__isnull": True}) & bounds(fallback)
+    return q
+
+
+def archive_dir():
+    return getattr(settings, "HISTORY_ARCHIVE_DIR", os.path.join(settings.BASE_DIR, "archive"))
+
+
+def month_after(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def retention_cutoff(months=None, tz=None):
+    """First day of the oldest month kept in the database."""
+    months = months or getattr(settings, "HISTORY_RETENTION_MONTHS", 6)
+    today = local_today(tz)
+    index = today.year * 12 + today.month - 1 - (months - 1)
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def expired_months(model, column, cutoff, tz, fallback=None):
+    """First days of the months of `model` that lie entirely before `cutoff`, oldest first."""
+    end = day_start(cutoff, tz)
+    candidates = [model.objects.filter(**{f"{column}__lt": end}).aggregate(m=Min(column))["m"]]
+    if fallback:
+        candidates.append(model.objects.filter(**{f"{column}__isnull": True, f"{fallback}__lt": end})
+                          .aggregate(m=Min(fallback))["m"])
+    candidates = [value for value in candidates if value is not None]
+    if not candidates:
+        return []
+    oldest = min(candidates)
+    oldest = oldest.astimezone(tz)
+    month, months = date(oldest.year, oldest.month, 1), []
+    while month < cutoff:
+        months.append(month)
+        month = month_after(month)
+    return months
+
+
+def write_archive(qs, fields, path, fmt="ndjson"):
+    """
+    Stream `qs` into a gzip file at `path` through a temp file linked into
+    place. FileExistsError if `path` exists: archive files are never replaced.
+    """
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as raw:
+            for block in iter_export(qs, fields, fmt, compress=True):
+                raw.write(block)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.link(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def part_files(directory, name, month):
+    """[(first id, last id, path)] of the part files of one table and month."""
+    pattern = re.compile(rf"{re.escape(name)}-{month:%Y-%m}-(\d+)-(\d+)\.(?:{'|'.join(FORMATS)})\.gz")
+    if not os.path.isdir(directory):
+        return []
+    return sorted((int(m.group(1)), int(m.group(2)), os.path.join(directory, m.group(0)))
+                  for m in map(pattern.fullmatch, os.listdir(directory)) if m)
+
+
+def part_ids(path):
+    """The row ids held by a part file, in file order."""
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as f:
+        if ".csv." in os.path.basename(path):
+            for row in csv.DictReader(f):
+                yield int(row["id"])
+        else:
+            for line in f:
+                yield json.loads(line)["id"]
+
+
+def _drop(rows, counter):
+    """Count `rows` into the Movie `counter` and delete them, in one transaction."""
+    from movies.models import Movie
+
+    with transaction.atomic():
+        for movie_id, n in rows.values_list("movie_id").annotate(n=Count("id")).order_by():
+            Movie.objects.filter(id=movie_id).update(**{counter: F(counter) + n})
+        count, _ = rows.delete()
+    return count
+
+
+def _drop_written(qs, counter, parts):
+    """
+    Drop the rows of `qs` that `parts` already hold: left behind by a run
+    stopped between writing its part file and deleting.
+    """
+    dropped = 0
+    for first, last, path in parts:
+        if not qs.filter(id__gte=first, id__lte=last).exists():
+            continue
+        batch = []
+        for row_id in part_ids(path):
+            batch.append(row_id)
+            if len(batch) == EXPORT_CHUNK:
+                dropped += _drop(qs.filter(id__in=batch), counter)
+                batch = []
+        if batch:
+            dropped += _drop(qs.filter(id__in=batch), counter)
+    return dropped
+
+
+def archive_month(name, model, column, counter, fields, month, fmt="ndjson", directory=None, tz=None, dry_run=False,
+                  fallback=None):
+    """
+    Archive and drop one month of one history table into a new part file.
+    Returns the number of rows moved (or that would be, with dry_run).
+    """
+    tz = tz or dashboard_tz()
+    start, end = day_start(month, tz), day_start(month_after(month), tz)
+    qs = model.objects.filter(in_period(column, fallback, start, end))
+    if dry_run:
+        return qs.count()
+
+    directory = directory or archive_dir()
+    dropped = _drop_written(qs, counter, part_files(directory, name, month))
+    bounds = qs.aggregate(first=Min("id"), last=Max("id"))
+    if bounds["last"] is None:
+        return dropped
+    archived = qs.filter(id__lte=bounds["last"])  # rows landing meanwhile wait for the next run
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}-{month:%Y-%m}-{bounds['first']}-{bounds['last']}.{fmt}.gz")
+    write_archive(archived, fields, path, fmt)
+    return dropped + _drop(archived, counter)
+
+
+def archive_expired(months=None, fmt="ndjson", directory=None, dry_run=False, log=None):
+    """Archive every expired month of every history table. Returns {(table, month): rows}."""
+    tz = dashboard_tz()
+    cutoff = retention_cutoff(months, tz)
+    if not dry_run:
+        # everything leaving the database must already be in the rollups
+        rollup_movie_stats()
+    done = {}
+    for name, model, column, counter, fields, fallback in history_tables():
+        for month in expired_months(model, column, cutoff, tz, fallback):
+            if not dry_run and name == "watchhistory":
+                store_daily_visits(month, month_after(month) - timedelta(days=1), tz)
+            done[(name, month)] = archive_month(name, model, column, counter, fields, month,
+                                                fmt, directory, tz, dry_run, fallback)
+            if log:
+                log(f"{name} {month:%Y-%m}: {done[(name, month)]} rows")
+    return done
@@ -0,0 +1,128 @@
+# movies/utils/cache.py
+"""
+Versioned caching for the public catalog.
+
+Cached entries remember the catalog version they were built from. Saving or
+deleting a Movie/Comment bumps that version (see movies/signals.py), which
+makes every entry stale at once without having to know its key.
+
+Stale entries are not thrown away: while one request rebuilds an entry
+(guarded by a short `cache.add` lock), every other request keeps getting
+the stale copy, so a version bump or expiry never turns into a stampede of
+identical queries.
+
+Works with any cache backend shared by the workers, including the
+FileBasedCache in settings, whose `add`/`incr` are not atomic across
+processes:
+- a bump stores a new random token instead of incrementing, so two
+  concurrent bumps can overwrite each other but never leave a version
+  that some entry was already built from;
+- the refresh lock is best effort: two processes can occasionally both
+  win it and rebuild the same entry once each, nothing worse.
+"""
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponse
+
+MOVIES_VERSION = "movies"
+COMMENTS_VERSION = "comments"
+
+FRESH_SECONDS = 60        # entry is served as-is for this long
+STALE_SECONDS = 60 * 30   # ...and kept as a stale fallback for this long
+LOCK_SECONDS = 30         # max time one rebuild may hold the refresh lock
+
+
+def _version_key(name):
+    return f"catalog:version:{name}"
+
+
+def _new_version():
+    # random rather than a counter: see the module docstring
+    return uuid.uuid4().hex[:16]
+
+
+def get_version(name):
+    version = cache.get(_version_key(name))
+    if version is None:
+        cache.add(_version_key(name), _new_version(), None)
+        version = cache.get(_version_key(name), "")
+    return version
+
+
+def bump_version(name):
+    version = _new_version()
+    cache.set(_version_key(name), version, None)
+    return version
+
+
+def catalog_version():
+    """Combined version of everything rendered on the public catalog pages."""
+    return f"{get_version(MOVIES_VERSION)}.{get_version(COMMENTS_VERSION)}"
+
+
+def get_or_refresh(key, builder, version=None, fresh_for=FRESH_SECONDS, stale_for=STALE_SECONDS):
+    """
+    Return the cached value for `key`, rebuilding it with `builder()` when it
+    is missing, older than `fresh_for` seconds or built from another version.
+    While one caller rebuilds, the others get the stale value.
+    """
+    version = catalog_version() if version is None else version
+    now = time.time()
+    entry = cache.get(key)
+    if entry is not None:
+        entry_version, built_at, value = entry
+        if entry_version == version and now - built_at < fresh_for:
+            return value
+        if not cache.add(f"{key}:lock", 1, LOCK_SECONDS):
+            return value  # someone else is refreshing: serve stale
+    else:
+        cache.add(f"{key}:lock", 1, LOCK_SECONDS)
+
+    try:
+        value = builder()
+        cache.set(key, (version, now, value), stale_for)
+    finally:
+        cache.delete(f"{key}:lock")
+    return value
+
+
+def cache_anonymous_page(fresh_for=FRESH_SECONDS, stale_for=STALE_SECONDS):
+    """
+    Cache whole GET responses for anonymous visitors, keyed by path + query
+    string and invalidated by the catalog version. Logged-in users (staff see
+    extra links) always get a fresh render.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD") or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = f"page:{view.__name__}:{digest}"
+            rendered = {}
+
+            def build():
+                response = view(request, *args, **kwargs)
+                rendered["response"] = response
+                if response.status_code != 200 or getattr(response, "streaming", False):
+                    return None
+                return (response.content, response.get("Content-Type"))
+
+            cached = get_or_refresh(key, build, fresh_for=fresh_for, stale_for=stale_for)
+            if "response" in rendered:
+                rendered["response"]["X-Cache"] = "MISS"
+                return rendered["response"]
+            if cached is None:
+                return view(request, *args, **kwargs)
+
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response["X-Cache"] = "HIT"
+            return response
+        return wrapper
+    return decorator
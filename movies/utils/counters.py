@@ -0,0 +1,102 @@
+# movies/utils/counters.py
+"""
+Sharded counters for the hot `Movie` columns (total_views, download_count).
+
+Incrementing `Movie.download_count` directly makes every download of a
+popular title wait for the same row lock. Instead each increment goes to one
+of COUNTER_SHARDS `MovieCounterShard` rows picked at random, so concurrent
+writers rarely touch the same row.
+
+The shards are folded back into the `Movie` columns at most once per
+COUNTER_FOLD_SECONDS (triggered by incoming increments once their
+transaction has committed, and by the `fold_counters` command). Pages keep reading the plain `Movie` columns, so
+reads stay a single row fetch; the displayed numbers may lag real activity
+by up to one fold interval.
+"""
+import random
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, When
+
+COUNTER_FIELDS = ("total_views", "download_count")
+FOLD_BATCH = 500
+
+_next_fold_check = 0.0
+
+
+def _shards():
+    return max(1, getattr(settings, "COUNTER_SHARDS", 16))
+
+
+def increment(movie_id, field, amount=1):
+    """Add `amount` to `field` of one movie through a random shard."""
+    from movies.models import MovieCounterShard
+
+    if field not in COUNTER_FIELDS:
+        raise ValueError(f"Unknown counter field: {field}")
+    slot = random.randrange(_shards())
+    shard = MovieCounterShard.objects.filter(movie_id=movie_id, field=field, slot=slot)
+    if not shard.update(value=F("value") + amount):
+        try:
+            with transaction.atomic():
+                MovieCounterShard.objects.create(movie_id=movie_id, field=field, slot=slot, value=amount)
+        except IntegrityError:
+            shard.update(value=F("value") + amount)  # created concurrently
+    # never inside the caller's transaction: a fold locks many Movie rows
+    transaction.on_commit(maybe_fold)
+
+
+def maybe_fold():
+    """Fold if no worker has done so within COUNTER_FOLD_SECONDS."""
+    global _next_fold_check
+    interval = getattr(settings, "COUNTER_FOLD_SECONDS", 30)
+    now = time.monotonic()
+    if now < _next_fold_check:
+        return  # checked recently in this process: skip the shared-cache round trip
+    _next_fold_check = now + min(interval, 5)
+    if cache.add("counters:fold", 1, interval):
+        fold()
+
+
+def fold(movie_ids=None):
+    """
+    Move shard values into the Movie columns. Each shard is decremented by
+    exactly what was read from it, so increments that land during the fold
+    are kept for the next one. Returns the number of movies updated.
+    """
+    from movies.models import Movie, MovieCounterShard
+
+    shards = MovieCounterShard.objects.exclude(value=0)
+    if movie_ids is not None:
+        shards = shards.filter(movie_id__in=movie_ids)
+    rows = list(shards.values_list("id", "movie_id", "field", "value"))
+    if not rows:
+        return 0
+
+    totals = defaultdict(dict)
+    for _, movie_id, field, value in rows:
+        totals[movie_id][field] = totals[movie_id].get(field, 0) + value
+
+    with transaction.atomic():
+        for start in range(0, len(rows), FOLD_BATCH):
+            batch = rows[start:start + FOLD_BATCH]
+            MovieCounterShard.objects.filter(id__in=[r[0] for r in batch]).update(
+                value=Case(*[When(id=shard_id, then=F("value") - value) for shard_id, _, _, value in batch]),
+            )
+        for movie_id, fields in totals.items():
+            Movie.objects.filter(id=movie_id).update(**{f: F(f) + n for f, n in fields.items()})
+    return len(totals)
+
+
+def pending(movie_id):
+    """{field: not yet folded amount} for one movie."""
+    from movies.models import MovieCounterShard
+
+    result = dict.fromkeys(COUNTER_FIELDS, 0)
+    for field, value in MovieCounterShard.objects.filter(movie_id=movie_id).values_list("field", "value"):
+        result[field] += value
+    return result
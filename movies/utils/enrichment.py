@@ -0,0 +1,125 @@
+# movies/utils/enrichment.py
+"""
+Background GeoIP enrichment for visitors.
+
+Visitor rows are written without a location (movies/utils/visitors.py);
+their addresses are queued here and a daemon thread fills in
+country/city/lat/lng every GEO_ENRICH_SECONDS, in bulk. `geo_checked_at`
+records that a lookup ran, so addresses GeoLite2 does not know are not
+looked up again on every dashboard load; `manage.py backfill_geoip
+--retry-failed` gives them another chance after a database update.
+
+Every process runs its own queue, so the same visitor can be queued in
+several. Each batch claims its rows first (row locks, skipping rows another
+process holds, where the database has them) and map cells are moved from
+the locked rows' current locations, so a visitor is counted once.
+
+Nothing on the request path waits for a lookup.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from movies.utils.geohash import encode as geohash_encode
+from movies.utils.geoip import EMPTY_LOCATION, resolver
+from movies.utils.mapcells import location_of, record_moves
+
+logger = logging.getLogger(__name__)
+
+GEO_FIELDS = ["country", "city", "lat", "lng", "geohash", "geo_checked_at"]
+LOCATION_FIELDS = ["id", "ip_address", "country", "city", "lat", "lng", "geohash"]
+
+
+def apply_locations(visitors, located, checked_at=None):
+    """Copy looked-up locations onto Visitor objects (for bulk_update with GEO_FIELDS)."""
+    checked_at = checked_at or timezone.now()
+    for visitor in visitors:
+        country, city, lat, lng = located.get(visitor.ip_address) or EMPTY_LOCATION
+        visitor.country = country or visitor.country
+        visitor.city = city or visitor.city
+        visitor.lat = lat or visitor.lat
+        visitor.lng = lng or visitor.lng
+        visitor.geohash = geohash_encode(visitor.lat, visitor.lng)
+        visitor.geo_checked_at = checked_at
+    return visitors
+
+
+def save_locations(visitors, located, checked_at=None):
+    """
+    `apply_locations` to the current rows of `visitors`, locked until they
+    are saved, and move them between map cells. The cells move from what
+    the rows hold now, not from the possibly stale `visitors`, so a visitor
+    located meanwhile by another process is not counted twice. `visitors`
+    get the saved values; returns the saved rows (without visitors deleted
+    meanwhile).
+    """
+    from movies.models import Visitor
+
+    with transaction.atomic():
+        rows = list(Visitor.objects.select_for_update().filter(id__in=[v.id for v in visitors])
+                    .order_by("id").only(*LOCATION_FIELDS))
+        before = [location_of(v) for v in rows]
+        apply_locations(rows, located, checked_at)
+        after = [location_of(v) for v in rows]
+        Visitor.objects.bulk_update(rows, GEO_FIELDS, batch_size=500)
+        record_moves(zip(before, after))
+    saved = {row.id: row for row in rows}
+    for visitor in visitors:  # keep the caller's objects in step with the rows
+        if visitor.id in saved:
+            for field in GEO_FIELDS:
+                setattr(visitor, field, getattr(saved[visitor.id], field))
+    return rows
+
+
+class GeoEnrichmentQueue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def enqueue(self, ips):
+        with self._lock:
+            self._pending.update(ip for ip in ips if ip)
+            size = len(self._pending)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="geo-enrichment", daemon=True)
+                self._thread.start()
+        if size >= getattr(settings, "GEO_ENRICH_BATCH", 500):
+            self._wake.set()
+
+    def _run(self):
+        interval = getattr(settings, "GEO_ENRICH_SECONDS", 5)
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.process()
+            except Exception:
+                logger.exception("GeoIP enrichment failed")
+
+    def process(self):
+        """Resolve everything queued so far. Returns the number of visitors updated."""
+        from movies.models import Visitor
+
+        with self._lock:
+            ips, self._pending = self._pending, set()
+        if not ips:
+            return 0
+        with transaction.atomic():
+            # claim: rows another process is resolving stay locked until it commits
+            pending = Visitor.objects.filter(ip_address__in=list(ips), geo_checked_at__isnull=True).order_by("id")
+            if connection.features.has_select_for_update_skip_locked:
+                pending = pending.select_for_update(skip_locked=True)
+            visitors = list(pending.only(*LOCATION_FIELDS))
+            if not visitors:
+                return 0
+            return len(save_locations(visitors, resolver.locate_many(v.ip_address for v in visitors)))
+
+
+# Process-wide queue fed by the watch-event flusher and the dashboard views
+geo_queue = GeoEnrichmentQueue()
@@ -0,0 +1,152 @@
+# movies/utils/events.py
+"""
+In-process publisher for the watch page Server-Sent Events stream.
+
+One `MovieChannel` per movie that somebody is watching in this worker. The
+channel's publisher task is the only thing that queries the database: it
+wakes up when a comment/viewer change is signalled in this process (see
+`EventHub.notify`) or every EVENTS_POLL_SECONDS to pick up changes made by
+other workers, and fans the resulting events out to every subscribed
+stream. Database load therefore scales with the number of movies being
+watched and the number of events, not with open tabs.
+
+Streaming needs the ASGI entry point (rwanda_film_vault/asgi.py); under
+WSGI the view declines and clients keep polling `comments_feed`.
+"""
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def format_event(kind, data, event_id=None):
+    """Serialize one SSE frame."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {kind}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class MovieChannel:
+    def __init__(self, movie_id, snapshot):
+        self.movie_id = movie_id
+        self.snapshot = snapshot
+        self.subscribers = set()
+        self.wake = asyncio.Event()
+        self.last_comment_id = 0
+        self.stats = None
+        self.task = None
+
+    def publish(self, kind, data, event_id=None):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait((kind, data, event_id))
+            except asyncio.QueueFull:
+                # slow client: end its stream, EventSource reconnects with Last-Event-ID
+                self.subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def run(self):
+        interval = getattr(settings, "EVENTS_POLL_SECONDS", 5)
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            try:
+                comments, stats = await sync_to_async(self.snapshot)(self.movie_id, self.last_comment_id)
+            except Exception:
+                logger.exception("Event snapshot failed for movie %s", self.movie_id)
+                continue
+            if comments:
+                self.last_comment_id = comments[-1]["id"]
+                self.publish("comments", comments, self.last_comment_id)
+            if stats != self.stats:
+                self.stats = stats
+                self.publish("stats", stats)
+
+
+class EventHub:
+    def __init__(self):
+        self.loop = None
+        self.channels = {}
+
+    async def _subscribe(self, movie_id, snapshot):
+        self.loop = asyncio.get_running_loop()
+        channel = self.channels.get(movie_id)
+        if channel is None:
+            fresh = MovieChannel(movie_id, snapshot)
+            # after_id=None: snapshot returns just the newest comment, if any
+            latest, fresh.stats = await sync_to_async(snapshot)(movie_id, None)
+            fresh.last_comment_id = latest[-1]["id"] if latest else 0
+            channel = self.channels.setdefault(movie_id, fresh)
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        channel.subscribers.add(queue)
+        if channel.task is None or channel.task.done():
+            channel.task = asyncio.create_task(channel.run())
+        return channel, queue
+
+    def _unsubscribe(self, channel, queue):
+        channel.subscribers.discard(queue)
+        if not channel.subscribers:
+            channel.wake.set()  # let the publisher loop notice and exit
+            if self.channels.get(channel.movie_id) is channel:
+                del self.channels[channel.movie_id]
+
+    def notify(self, movie_id):
+        """
+        Thread-safe nudge from sync code (signal receivers, sync views):
+        the movie's publisher re-reads its snapshot right away.
+        """
+        loop, channel = self.loop, self.channels.get(movie_id)
+        if loop is None or channel is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(channel.wake.set)
+
+    async def stream(self, movie_id, since_id, snapshot):
+        """
+        Async generator of SSE frames for one client: a catch-up of comments
+        after `since_id`, the current stats, then live events and keepalives.
+        """
+        heartbeat = getattr(settings, "EVENTS_HEARTBEAT_SECONDS", 15)
+        channel, queue = await self._subscribe(movie_id, snapshot)
+        try:
+            yield "retry: 5000\n\n"
+            comments, stats = await sync_to_async(snapshot)(movie_id, since_id)
+            if comments:
+                since_id = comments[-1]["id"]
+                yield format_event("comments", comments, since_id)
+            yield format_event("stats", stats)
+
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is None:
+                    break
+                kind, data, event_id = item
+                if kind == "comments":
+                    data = [c for c in data if c["id"] > since_id]
+                    if not data:
+                        continue
+                    since_id = data[-1]["id"]
+                yield format_event(kind, data, event_id)
+        finally:
+            self._unsubscribe(channel, queue)
+
+
+# Process-wide hub used by the streaming view and the signal receivers
+hub = EventHub()
@@ -0,0 +1,127 @@
+# movies/utils/exports.py
+"""
+Streaming exports of the history tables.
+
+Rows are read in id order through `.iterator(chunk_size=...)` (a
+server-side cursor on PostgreSQL), encoded as CSV or NDJSON and handed out
+in blocks of EXPORT_BLOCK_ROWS rows, optionally gzip-compressed on the fly,
+so memory stays flat whatever the table size. Used by the staff export
+endpoint, the `export_history` command and the history archiver
+(movies/utils/archive.py).
+
+Under ASGI, Django would collect a sync iterator into a list before
+sending it; `aiter_blocks` pulls one block at a time in the sync thread
+instead.
+"""
+import csv
+import io
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from movies.utils.rollups import dashboard_tz, day_start
+
+FORMATS = ("ndjson", "csv")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_CHUNK = 2000  # rows per cursor fetch
+EXPORT_BLOCK_ROWS = 1000  # rows per yielded block
+
+
+def export_sources():
+    """{kind: (model, time column, exported fields)}"""
+    from movies.models import DownloadHistory, Visitor, WatchHistory
+
+    return {
+        "watch": (WatchHistory, "start_time",
+                  ("id", "movie_id", "user_id", "ip_address", "session_key", "start_time", "end_time", "duration", "last_seen")),
+        "downloads": (DownloadHistory, "downloaded_at",
+                      ("id", "movie_id", "user_id", "ip_address", "downloaded_at")),
+        "visitors": (Visitor, "last_visit",
+                     ("id", "ip_address", "country", "city", "lat", "lng", "geohash",
+                      "first_visit", "last_visit", "visit_count", "known")),
+    }
+
+
+def parse_bound(raw):
+    """
+    since/until value: an ISO datetime (naive ones in DASHBOARD_TIME_ZONE) or
+    a date, meaning its local midnight. None when blank; ValueError when invalid.
+    """
+    if not raw:
+        return None
+    tz = dashboard_tz()
+    value = parse_datetime(raw)
+    if value is None:
+        day = parse_date(raw)
+        if day is None:
+            raise ValueError(f"Invalid date: {raw}")
+        return day_start(day, tz)
+    return timezone.make_aware(value, tz) if timezone.is_naive(value) else value
+
+
+def export_queryset(kind, since=None, until=None):
+    """(queryset, fields) of one export kind, limited to [since, until) on its time column."""
+    model, column, fields = export_sources()[kind]
+    qs = model.objects.all()
+    if since is not None:
+        qs = qs.filter(**{f"{column}__gte": since})
+    if until is not None:
+        qs = qs.filter(**{f"{column}__lt": until})
+    return qs, fields
+
+
+def _csv_value(value, encoder):
+    if value is None:
+        return ""
+    if isinstance(value, (str, int, float)):
+        return value
+    return encoder.default(value)  # datetimes, durations, UUIDs as in NDJSON
+
+
+def iter_export(qs, fields, fmt="ndjson", compress=False):
+    """Yield the rows of `qs` as encoded blocks of bytes (gzip members when `compress`)."""
+    encoder = DjangoJSONEncoder()
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == "csv" else None
+
+    def take():
+        data = buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+        return gz.compress(data) if gz else data
+
+    if writer:
+        writer.writerow(fields)
+    rows = 0
+    for values in qs.order_by("id").values_list(*fields).iterator(chunk_size=EXPORT_CHUNK):
+        if writer:
+            writer.writerow([_csv_value(v, encoder) for v in values])
+        else:
+            buf.write(json.dumps(dict(zip(fields, values)), cls=DjangoJSONEncoder) + "\n")
+        rows += 1
+        if rows % EXPORT_BLOCK_ROWS == 0:
+            block = take()
+            if block:
+                yield block
+    block = take()
+    if gz:
+        block += gz.flush()
+    if block:
+        yield block
+
+
+async def aiter_blocks(blocks):
+    """Async view of a sync block iterator, advanced one block at a time in the sync thread."""
+    blocks = iter(blocks)
+    done = object()
+    step = sync_to_async(next, thread_sensitive=True)
+    while True:
+        block = await step(blocks, done)
+        if block is done:
+            return
+        yield block
@@ -0,0 +1,72 @@
+# movies/utils/geohash.py
+"""
+Geohash encoding for map aggregation.
+
+Each visitor with a location stores a GEOHASH_PRECISION-character geohash;
+the map groups visitors by a prefix of it, and nearby points share longer
+prefixes. The prefix length grows with the map zoom level so a cluster
+stays roughly the same size on screen; counts per prefix are kept in
+VisitorMapCell (movies/utils/mapcells.py).
+"""
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+GEOHASH_PRECISION = 9  # ~5 m cells; more than any zoom level needs
+
+# (max zoom, prefix length): about one cell per 60-120 px of map
+_ZOOM_PRECISION = ((2, 2), (5, 3), (8, 4), (10, 5), (13, 6))
+MAX_CLUSTER_PRECISION = 7
+
+
+def encode(lat, lng, precision=GEOHASH_PRECISION):
+    """Geohash of a point; "" when there is no usable location."""
+    if lat is None or lng is None or (not lat and not lng):
+        return ""
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return ""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def decode(geohash):
+    """Center (lat, lng) of a geohash cell."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2
+
+
+def cell_size(precision):
+    """(lat degrees, lng degrees) covered by a cell of `precision` characters."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** (bits - bits // 2)
+
+
+def precision_for_zoom(zoom):
+    for max_zoom, precision in _ZOOM_PRECISION:
+        if zoom <= max_zoom:
+            return precision
+    return MAX_CLUSTER_PRECISION
@@ -0,0 +1,166 @@
+# movies/utils/geoip.py
+"""
+Process-wide GeoIP resolver.
+
+The GeoLite2 database is opened once per process in MODE_MMAP (the OS page
+cache is shared by all workers) and reopened when the file on disk changes,
+checked at most every GEOIP_RELOAD_CHECK_SECONDS.
+
+Results go into a bounded LRU keyed by address, backed by a second LRU keyed
+by network prefix (/24 for IPv4, /48 for IPv6): GeoLite2 rarely splits
+those, so a neighbour's answer is reused instead of hitting the database.
+"""
+import ipaddress
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import geoip2.database
+from django.conf import settings
+
+EMPTY_LOCATION = ("", "", 0.0, 0.0)
+IPV4_PREFIX = 24
+IPV6_PREFIX = 48
+
+
+class _LRU:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is not None:
+            self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+
+
+class GeoResolver:
+    def __init__(self, path=None, cache_size=None):
+        self._path = path
+        cache_size = cache_size or getattr(settings, "GEOIP_CACHE_SIZE", 10000)
+        self._lock = threading.Lock()
+        self._by_ip = _LRU(cache_size)
+        self._by_prefix = _LRU(cache_size)
+        self._reader = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self.hits = self.prefix_hits = self.misses = self.reloads = 0
+
+    @property
+    def path(self):
+        return self._path or getattr(settings, "GEOIP_PATH", os.path.join(settings.BASE_DIR, "GeoLite2-City.mmdb"))
+
+    # ------------------------------------------------------------
+    # Reader lifecycle
+    # ------------------------------------------------------------
+    def _current_reader(self):
+        """The open reader, (re)opened if the file appeared or changed. Call with the lock held."""
+        now = time.monotonic()
+        if self._checked_at and now - self._checked_at < getattr(settings, "GEOIP_RELOAD_CHECK_SECONDS", 60):
+            return self._reader
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._close()
+            if mtime is not None:
+                try:
+                    self._reader = geoip2.database.Reader(self.path, mode=geoip2.database.MODE_MMAP)
+                except Exception:
+                    self._reader = None
+                self.reloads += 1
+            self._mtime = mtime
+            self._by_ip.clear()
+            self._by_prefix.clear()
+        return self._reader
+
+    def _close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+            self._mtime = None
+
+    # ------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------
+    @staticmethod
+    def _parse(ip):
+        """(address, prefix network) or None for invalid/private addresses."""
+        try:
+            addr = ipaddress.ip_address(str(ip).strip())
+        except ValueError:
+            return None
+        if addr.is_private or addr.is_loopback or addr.is_reserved or addr.is_multicast:
+            return None
+        bits = IPV4_PREFIX if addr.version == 4 else IPV6_PREFIX
+        return addr, ipaddress.ip_network(f"{addr}/{bits}", strict=False)
+
+    def locate(self, ip):
+        """(country, city, latitude, longitude); empty values when unknown."""
+        parsed = self._parse(ip)
+        if parsed is None:
+            return EMPTY_LOCATION
+        addr, network = parsed
+        with self._lock:
+            reader = self._current_reader()
+            cached = self._by_ip.get(addr)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            cached = self._by_prefix.get(network)
+            if cached is not None:
+                self.prefix_hits += 1
+                self._by_ip.put(addr, cached)
+                return cached
+            self.misses += 1
+            location = EMPTY_LOCATION
+            if reader is not None:
+                try:
+                    response = reader.city(str(addr))
+                    location = (
+                        response.country.name or "",
+                        response.city.name or "",
+                        response.location.latitude or 0.0,
+                        response.location.longitude or 0.0,
+                    )
+                except Exception:
+                    pass  # not in the database
+            self._by_ip.put(addr, location)
+            self._by_prefix.put(network, location)
+            return location
+
+    def locate_many(self, ips):
+        """{ip: location} for an iterable of addresses, each distinct one resolved once."""
+        return {ip: self.locate(ip) for ip in set(ips)}
+
+    def stats(self):
+        lookups = self.hits + self.prefix_hits + self.misses
+        return {
+            "hits": self.hits,
+            "prefix_hits": self.prefix_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.prefix_hits) / lookups if lookups else 0.0,
+            "cached": len(self._by_ip.data),
+            "reloads": self.reloads,
+        }
+
+
+# Process-wide resolver used by views, the watch-event flusher and commands
+resolver = GeoResolver()
@@ -0,0 +1,276 @@
+# movies/utils/ingest.py
+"""
+Write-behind buffer for watch-session events.
+
+`start_watch` / `stop_watch` only append an event to an in-process buffer
+and answer immediately; a background thread applies the buffered events in
+bulk every WATCH_FLUSH_SECONDS (default 2s), or sooner once
+WATCH_FLUSH_BATCH events are waiting:
+
+  1. close sessions left open by the same (movie, ip)
+  2. bulk_create the new WatchHistory rows
+  3. one sharded `total_views` increment per movie (movies/utils/counters.py)
+  4. one INSERT ... ON CONFLICT for the visitors (movies/utils/visitors.py);
+     their locations are filled in afterwards by movies/utils/enrichment.py
+  5. apply stop events, after the inserts they may refer to
+
+Every write bumps `last_seen`, the high-water column movies/utils/rollups.py
+reads to find what changed.
+
+Ordering: events are applied in arrival order within a process; a stop is
+always applied after the start it closes, whether that start is in the same
+batch or an earlier one. Across workers there is no global order, which is
+fine because sessions never span workers.
+
+Crash safety: a batch runs in one transaction. If the database is
+unreachable or busy (OperationalError) the whole batch is put back and
+retried on the next tick; while flushes keep failing, events past
+MAX_BUFFERED are dropped instead of flushed inline on every request. Any
+other error means some event itself is bad: the batch is split in halves
+until the bad events are isolated, and those go to `dead_letters` (logged)
+instead of blocking everything behind them. Client addresses are validated
+in `start()`, so a spoofed X-Forwarded-For never reaches the inet column.
+
+Events still in memory are flushed at interpreter exit (graceful gunicorn
+restarts), but a hard kill of a worker loses at most one flush interval of
+watch events. Only viewing statistics are at risk, never user content.
+
+Set WATCH_WRITE_BEHIND = False to apply every event synchronously instead
+(handy for debugging and tests).
+"""
+import atexit
+import ipaddress
+import logging
+import threading
+import uuid
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from movies.utils.visitors import Visit, record_visits
+
+logger = logging.getLogger(__name__)
+
+MAX_BUFFERED = 20000  # past this, appends flush inline (backpressure)
+MAX_DEAD_LETTERS = 1000  # most recent events that could not be applied
+
+
+def new_session_key():
+    return uuid.uuid4()
+
+
+class WatchEventBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._events = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._pending_starts = {}  # session key -> start time, until flushed
+        self._failing = False  # last flush could not reach the database
+        self.dead_letters = deque(maxlen=MAX_DEAD_LETTERS)
+
+    # ------------------------------------------------------------
+    # Producers (request threads)
+    # ------------------------------------------------------------
+    def start(self, session_key, movie_id, ip, user_id=None):
+        """Queue the start of a session. ValueError when `ip` is not an IP address."""
+        ip = str(ipaddress.ip_address((ip or "").strip()))
+        started = timezone.now()
+        self._append(("start", session_key, movie_id, ip, user_id, started))
+        return started
+
+    def pending_start(self, session_key):
+        """Start time of a session whose start is still buffered here, else None."""
+        with self._lock:
+            return self._pending_starts.get(session_key)
+
+    def stop(self, session_key):
+        """Queue the end of a session; returns (start time or None, end time)."""
+        ended = timezone.now()
+        started = self.pending_start(session_key)
+        self._append(("stop", session_key, ended))
+        return started, ended
+
+    def _append(self, event):
+        if not getattr(settings, "WATCH_WRITE_BEHIND", True):
+            self._apply([event])
+            return
+        with self._lock:
+            self._events.append(event)
+            if event[0] == "start":
+                self._pending_starts[event[1]] = event[5]
+            size = len(self._events)
+        if size >= MAX_BUFFERED:
+            if self._failing:
+                self._drop_oldest(size - MAX_BUFFERED)
+            else:
+                self.flush()
+            return
+        self._ensure_thread()
+        if size >= getattr(settings, "WATCH_FLUSH_BATCH", 500):
+            self._wake.set()
+
+    # ------------------------------------------------------------
+    # Flusher
+    # ------------------------------------------------------------
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="watch-flusher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        interval = getattr(settings, "WATCH_FLUSH_SECONDS", 2)
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            close_old_connections()
+            self.flush()
+
+    def flush(self):
+        """Apply everything buffered so far. Returns the number of events applied."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+            if not events:
+                return 0
+            try:
+                self._apply(events)
+                applied = events
+            except OperationalError:
+                logger.exception("Watch event flush failed; %d events re-queued", len(events))
+                self._failing = True
+                with self._lock:
+                    self._events[:0] = events
+                return 0
+            except Exception:
+                logger.exception("Watch event flush failed; isolating the bad events")
+                applied, settled = [], set()
+                middle = len(events) // 2
+                try:
+                    for part in (events[:middle], events[middle:]):
+                        self._apply_isolated(part, applied, settled)
+                except OperationalError:
+                    logger.exception("Database lost while isolating bad watch events; re-queuing the rest")
+                    self._failing = True
+                    with self._lock:
+                        self._events[:0] = [e for e in events if id(e) not in settled]
+                    self._forget(applied)
+                    return len(applied)
+            self._failing = False
+            self._forget(applied)
+            return len(applied)
+
+    def _apply_isolated(self, events, applied, settled):
+        """
+        Apply `events`, splitting them in halves on failure, recursively, so
+        only the events that fail on their own are set aside in `dead_letters`. Applied events are added to
+        `applied`; the ids of applied and set-aside events to `settled`.
+        """
+        if not events:
+            return
+        try:
+            self._apply(events)
+        except OperationalError:
+            raise
+        except Exception as exc:
+            if len(events) > 1:
+                middle = len(events) // 2
+                self._apply_isolated(events[:middle], applied, settled)
+                self._apply_isolated(events[middle:], applied, settled)
+                return
+            logger.error("Watch event moved to dead letters: %r (%s)", events[0], exc)
+            self.dead_letters.append((events[0], repr(exc)))
+            self._forget(events)
+        else:
+            applied.extend(events)
+        settled.update(id(e) for e in events)
+
+    def _drop_oldest(self, n):
+        """Backpressure while the database is unreachable: set aside the `n` oldest events."""
+        with self._lock:
+            dropped, self._events = self._events[:n], self._events[n:]
+        if dropped:
+            logger.error("Watch event buffer full while flushes fail; dropped %d events", len(dropped))
+            self.dead_letters.extend((event, "buffer full") for event in dropped)
+            self._forget(dropped)
+
+    def _forget(self, events):
+        with self._lock:
+            for event in events:
+                if event[0] == "start":
+                    self._pending_starts.pop(event[1], None)
+
+    def _apply(self, events):
+        from movies.models import Movie, WatchHistory
+        from movies.utils import counters, presence
+        from movies.utils.enrichment import geo_queue
+        from movies.utils.events import hub
+
+        starts = [e for e in events if e[0] == "start"]
+        stops = [e for e in events if e[0] == "stop"]
+        movie_ids = set(Movie.objects.filter(id__in={e[2] for e in starts}).values_list("id", flat=True))
+        starts = [e for e in starts if e[2] in movie_ids]
+
+        # one open session per (movie, ip): later starts in the batch close earlier ones
+        rows, latest = [], {}
+        for _, key, movie_id, ip, user_id, started in starts:
+            previous = latest.get((movie_id, ip))
+            if previous is not None:
+                previous.end_time = started
+                previous.duration = started - previous.start_time
+            latest[(movie_id, ip)] = row = WatchHistory(
+                session_key=key, movie_id=movie_id, ip_address=ip, user_id=user_id, start_time=started,
+            )
+            rows.append(row)
+
+        with transaction.atomic():
+            if latest:
+                dangling = Q()
+                for movie_id, ip in latest:
+                    dangling |= Q(movie_id=movie_id, ip_address=ip)
+                now = timezone.now()
+                WatchHistory.objects.filter(dangling, end_time__isnull=True).update(end_time=now, last_seen=now)
+                WatchHistory.objects.bulk_create(rows, batch_size=500)
+
+                for movie_id, n in Counter(row.movie_id for row in rows).items():
+                    counters.increment(movie_id, "total_views", n)
+
+                record_visits(_visits_of(rows))
+
+            for _, key, ended in stops:
+                WatchHistory.objects.filter(session_key=key, end_time__isnull=True).update(
+                    end_time=ended, duration=ended - F("start_time"), last_seen=timezone.now(),
+                )
+
+        # presence, push notifications and GeoIP only once the rows are committed
+        geo_queue.enqueue({row.ip_address for row in rows})
+        stopped = {e[1] for e in stops}
+        for row in rows:
+            if row.session_key not in stopped and row.end_time is None:
+                presence.heartbeat(row.movie_id, row.session_key)
+            hub.notify(row.movie_id)
+        if stops:
+            for key, movie_id in WatchHistory.objects.filter(session_key__in=stopped).values_list("session_key", "movie_id"):
+                presence.leave(movie_id, key)
+                hub.notify(movie_id)
+
+
+def _visits_of(rows):
+    """One Visit per address in the batch; locations are filled in later by the geo queue."""
+    plays = Counter(row.ip_address for row in rows)
+    last_seen = {}
+    for row in rows:
+        last_seen[row.ip_address] = max(row.start_time, last_seen.get(row.ip_address, row.start_time))
+    return {ip: Visit(n, last_seen[ip], None) for ip, n in plays.items()}
+
+
+# Process-wide buffer used by the watch tracking views
+watch_events = WatchEventBuffer()
+atexit.register(watch_events.flush)
@@ -1,7 +1,7 @@
 # utils/ip_tracker.py
-import geoip2.database
-from django.conf import settings
-import os
+import ipaddress
+
+from .geoip import resolver
 
 
 def get_client_ip(request):
@@ -16,23 +16,26 @@ def get_client_ip(request):
     return ip
 
 
+def is_private_ip(ip):
+    """
+    Returns True if the IP is private or local.
+    """
+    try:
+        ip_obj = ipaddress.ip_address(ip)
+        return ip_obj.is_private or ip_obj.is_loopback or ip_obj.is_reserved
+    except ValueError:
+        return True  # Treat invalid IP as private
+
+
 def get_geoip_location(ip):
     """
     Returns (country, city, latitude, longitude).
-    Requires GeoLite2-City.mmdb file in your BASE_DIR or GEOIP_PATH.
+    Served by the shared memory-mapped reader and its LRU cache
+    (movies/utils/geoip.py); private or unknown IPs return empty/defaults.
     """
-    try:
-        # Default: look for GeoLite2-City.mmdb in BASE_DIR
-        db_path = getattr(settings, "GEOIP_PATH", os.path.join(settings.BASE_DIR, "GeoLite2-City.mmdb"))
-        reader = geoip2.database.Reader(db_path)
-
-        response = reader.city(ip)
-        country = response.country.name or ""
-        city = response.city.name or ""
-        lat = response.location.latitude or 0.0
-        lng = response.location.longitude or 0.0
-        reader.close()
-
-        return country, city, lat, lng
-    except Exception:
-        return "", "", 0.0, 0.0
+    return resolver.locate(ip)
+
+
+def get_geoip_locations(ips):
+    """Batch form of `get_geoip_location`: {ip: (country, city, lat, lng)}."""
+    return resolver.locate_many(ips)
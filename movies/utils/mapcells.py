@@ -0,0 +1,102 @@
+# movies/utils/mapcells.py
+"""
+Pre-aggregated visitor counts for the dashboard map.
+
+Every located visitor is counted in one VisitorMapCell per precision in
+CELL_PRECISIONS (the geohash prefix lengths `precision_for_zoom` can ask
+for), together with the sums of its lat/lng for the cluster centroid. The
+map endpoint only reads the cells inside the viewport, so its cost follows
+the number of cells on screen, not the number of visitors.
+
+Cells are adjusted by `record_moves` whenever a visitor's location changes:
+GeoIP enrichment and `backfill_geoip` (movies/utils/enrichment.py), and
+Visitor saves and deletes (movies/signals.py). `rebuild()` recounts
+everything from the Visitor table (`manage.py rebuild_map_cells`).
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+
+from movies.utils.geohash import MAX_CLUSTER_PRECISION, decode
+
+CELL_PRECISIONS = tuple(range(2, MAX_CLUSTER_PRECISION + 1))
+NO_LOCATION = ("", 0.0, 0.0)
+UPDATE_BATCH = 500
+
+
+def location_of(visitor):
+    """(geohash, lat, lng) of a Visitor as the cells count it."""
+    return (visitor.geohash, visitor.lat, visitor.lng) if visitor.geohash else NO_LOCATION
+
+
+def _add(totals, location, sign=1):
+    geohash, lat, lng = location
+    if not geohash:
+        return
+    for precision in CELL_PRECISIONS:
+        total = totals[(precision, geohash[:precision])]
+        total[0] += sign
+        total[1] += sign * lat
+        total[2] += sign * lng
+
+
+def _new_cell(precision, cell, visitors=0, lat_sum=0.0, lng_sum=0.0):
+    from movies.models import VisitorMapCell
+
+    lat, lng = decode(cell)
+    return VisitorMapCell(precision=precision, cell=cell, lat=lat, lng=lng,
+                          visitors=visitors, lat_sum=lat_sum, lng_sum=lng_sum)
+
+
+def record_moves(moves):
+    """
+    Apply location changes to the cells. `moves` yields (before, after)
+    pairs of (geohash, lat, lng); NO_LOCATION for a visitor without one.
+    Returns the number of cells touched.
+    """
+    from movies.models import VisitorMapCell
+
+    deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    for before, after in moves:
+        if before != after:
+            _add(deltas, before, -1)
+            _add(deltas, after)
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return 0
+
+    with transaction.atomic():
+        VisitorMapCell.objects.bulk_create([_new_cell(*key) for key in deltas], ignore_conflicts=True)
+        by_precision = defaultdict(list)
+        for precision, cell in deltas:
+            by_precision[precision].append(cell)
+        keys = Q()
+        for precision, cells in by_precision.items():
+            keys |= Q(precision=precision, cell__in=cells)
+        rows = [(cell_id, deltas[(precision, cell)])
+                for cell_id, precision, cell in VisitorMapCell.objects.filter(keys).values_list("id", "precision", "cell")]
+        for start in range(0, len(rows), UPDATE_BATCH):
+            batch = rows[start:start + UPDATE_BATCH]
+            VisitorMapCell.objects.filter(id__in=[cell_id for cell_id, _ in batch]).update(**{
+                field: Case(*[When(id=cell_id, then=F(field) + delta[i]) for cell_id, delta in batch])
+                for i, field in enumerate(("visitors", "lat_sum", "lng_sum"))
+            })
+    return len(deltas)
+
+
+def rebuild():
+    """Recount every cell from the Visitor table. Returns the number of cells."""
+    from movies.models import Visitor, VisitorMapCell
+
+    totals = defaultdict(lambda: [0, 0.0, 0.0])
+    located = Visitor.objects.exclude(geohash="").values_list("geohash", "lat", "lng").order_by()
+    for location in located.iterator(chunk_size=2000):
+        _add(totals, location)
+    with transaction.atomic():
+        VisitorMapCell.objects.all().delete()
+        VisitorMapCell.objects.bulk_create(
+            [_new_cell(precision, cell, *total) for (precision, cell), total in totals.items()],
+            batch_size=UPDATE_BATCH,
+        )
+    return len(totals)
@@ -0,0 +1,96 @@
+# movies/utils/pagination.py
+"""
+Keyset (cursor) pagination for the movie catalog.
+
+Instead of OFFSET, every page remembers the sort key of its last row and the
+next page starts strictly after it, so page 500 costs the same index range
+scan as page 1.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+# sort name -> ordering columns (all descending, `id` is the tie-breaker)
+CATALOG_SORTS = {
+    "new": ("uploaded_at", "id"),
+    "trending": ("download_count", "uploaded_at", "id"),
+}
+DEFAULT_SORT = "new"
+
+
+def normalize_sort(sort):
+    return sort if sort in CATALOG_SORTS else DEFAULT_SORT
+
+
+def encode_cursor(values):
+    """Encode a tuple of sort-key values into an opaque URL-safe token."""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, fields):
+    """
+    Decode a token produced by `encode_cursor`.
+    Returns None for missing, malformed or mismatched cursors.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(fields):
+        return None
+
+    decoded = []
+    for field, value in zip(fields, values):
+        if field == "uploaded_at":
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                return None
+        elif not isinstance(value, int):
+            return None
+        decoded.append(value)
+    return decoded
+
+
+def _after(fields, values):
+    """
+    Build the "row comes after the cursor" filter for a descending sort:
+    a <= x AND ((a < x) OR (a = x AND b < y) OR (a = x AND b = y AND c < z) ...)
+    The redundant `a <= x` bounds the first index column, so the database
+    seeks into the keyset index instead of scanning it from the top.
+    """
+    condition = Q()
+    for i, field in enumerate(fields):
+        term = Q(**{f"{field}__lt": values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            term &= Q(**{prev_field: prev_value})
+        condition |= term
+    return Q(**{f"{fields[0]}__lte": values[0]}) & condition
+
+
+def keyset_page(queryset, sort, cursor, limit):
+    """
+    Return (items, next_cursor) for one page of `queryset`.
+    `next_cursor` is None on the last page.
+    """
+    fields = CATALOG_SORTS[normalize_sort(sort)]
+    queryset = queryset.order_by(*[f"-{f}" for f in fields])
+
+    values = decode_cursor(cursor, fields)
+    if values is not None:
+        queryset = queryset.filter(_after(fields, values))
+
+    items = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, f) for f in fields])
+    return items, next_cursor
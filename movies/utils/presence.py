@@ -0,0 +1,136 @@
+# movies/utils/presence.py
+"""
+Heartbeat-based live-viewer tracking.
+
+A viewer is "live" while its player keeps sending heartbeats: every beat
+refreshes one `ViewerPresence` row (movie, viewer), and a viewer whose last
+beat is older than PRESENCE_WINDOW_SECONDS simply drops out of the window.
+The table only ever holds the people watching right now; expired rows are
+swept at most once per PRESENCE_SWEEP_SECONDS by whichever request gets there
+first.
+
+The table is the state shared by all gunicorn workers. Reads never scan it
+per request: the per-movie count is kept in the shared cache for
+PRESENCE_COUNT_SECONDS (dropped immediately when somebody joins or leaves),
+so `live_count` is a cache lookup and at most one indexed range count per
+movie every few seconds.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+# a beat arriving sooner than this after the last stored one is not written
+WRITE_EVERY_SECONDS = 10
+
+_recent_writes = {}
+_recent_lock = threading.Lock()
+
+
+def _window():
+    return getattr(settings, "PRESENCE_WINDOW_SECONDS", 45)
+
+
+def _count_key(movie_id):
+    return f"presence:count:{movie_id}"
+
+
+def _wrote_recently(movie_id, viewer):
+    """Per-process throttle so chatty clients cost at most one write per interval."""
+    now = time.monotonic()
+    with _recent_lock:
+        last = _recent_writes.get((movie_id, viewer))
+        if last is not None and now - last < WRITE_EVERY_SECONDS:
+            return True
+        _recent_writes[(movie_id, viewer)] = now
+        if len(_recent_writes) > 10000:
+            cutoff = now - _window()
+            for key in [k for k, t in _recent_writes.items() if t < cutoff]:
+                del _recent_writes[key]
+    return False
+
+
+def heartbeat(movie_id, viewer):
+    """
+    Mark `viewer` (an opaque per-tab key) as watching `movie_id`.
+    Returns True when the viewer was not live before (a join).
+    """
+    from movies.models import ViewerPresence
+
+    viewer = str(viewer)[:64]
+    if _wrote_recently(movie_id, viewer):
+        return False
+
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=_window())
+    # refreshing an expired row counts as a join as well
+    if ViewerPresence.objects.filter(movie_id=movie_id, viewer=viewer, last_seen__gte=cutoff).update(last_seen=now):
+        return False
+    if not ViewerPresence.objects.filter(movie_id=movie_id, viewer=viewer).update(last_seen=now):
+        try:
+            with transaction.atomic():
+                ViewerPresence.objects.create(movie_id=movie_id, viewer=viewer, last_seen=now)
+        except IntegrityError:
+            return False  # a concurrent beat from the same viewer created it
+    cache.delete(_count_key(movie_id))
+    _maybe_sweep()
+    return True
+
+
+def leave(movie_id, viewer):
+    """Drop `viewer` from the movie's live set (player stopped / tab closed)."""
+    from movies.models import ViewerPresence
+
+    viewer = str(viewer)[:64]
+    with _recent_lock:
+        _recent_writes.pop((movie_id, viewer), None)
+    if ViewerPresence.objects.filter(movie_id=movie_id, viewer=viewer).delete()[0]:
+        cache.delete(_count_key(movie_id))
+
+
+def live_count(movie_id):
+    """Number of viewers whose last heartbeat is inside the window."""
+    count = cache.get(_count_key(movie_id))
+    if count is None:
+        count = live_counts([movie_id])[movie_id]
+    return count
+
+
+def live_counts(movie_ids):
+    """{movie_id: live viewers} for several movies, one query for the cache misses."""
+    from movies.models import ViewerPresence
+
+    movie_ids = list(movie_ids)
+    cached = cache.get_many([_count_key(i) for i in movie_ids])
+    counts = {i: cached.get(_count_key(i)) for i in movie_ids}
+    missing = [i for i, c in counts.items() if c is None]
+    if missing:
+        cutoff = timezone.now() - timedelta(seconds=_window())
+        fresh = dict(
+            ViewerPresence.objects.filter(movie_id__in=missing, last_seen__gte=cutoff)
+            .values("movie_id")
+            .annotate(n=Count("id"))
+            .values_list("movie_id", "n")
+        )
+        ttl = getattr(settings, "PRESENCE_COUNT_SECONDS", 5)
+        cache.set_many({_count_key(i): fresh.get(i, 0) for i in missing}, ttl)
+        counts.update({i: fresh.get(i, 0) for i in missing})
+    return counts
+
+
+def _maybe_sweep():
+    if cache.add("presence:sweep", 1, getattr(settings, "PRESENCE_SWEEP_SECONDS", 60)):
+        sweep()
+
+
+def sweep():
+    """Delete presence rows that fell out of the window. Returns rows removed."""
+    from movies.models import ViewerPresence
+
+    cutoff = timezone.now() - timedelta(seconds=_window())
+    return ViewerPresence.objects.filter(last_seen__lt=cutoff).delete()[0]
@@ -0,0 +1,283 @@
+# movies/utils/rollups.py
+"""
+Pre-aggregated dashboard statistics.
+
+`DailyVisitStats` keeps one row per calendar day in DASHBOARD_TIME_ZONE
+(defaults to TIME_ZONE) with the number of plays and distinct visitor
+addresses seen that day. A closed day is computed once, on first request,
+with a single GROUP BY over the `start_time` index and then served from
+the table, so a 365-day chart costs the same as a 7-day one.
+
+The most recent OPEN_DAYS days (today and yesterday) are always counted live
+from WatchHistory: they still change, and write-behind ingestion can land
+rows slightly after midnight. Recomputing a day replaces its row, so
+running the rollup again over the same data gives the same result.
+
+`MovieStatsRollup` holds plays, downloads, watch time and distinct viewer
+addresses per movie per local hour and per local day. `rollup_movie_stats`
+folds raw rows in incrementally: it picks up the WatchHistory rows whose
+`last_seen` (bumped on every insert and stop) and the DownloadHistory rows
+whose `downloaded_at` passed the stored high-water mark, and rebuilds every
+(movie, day) they touch from the raw tables, hourly rows included. Rebuilding
+whole days keeps it idempotent, and distinct counts stay exact. The mark is
+rewound by ROLLUP_LATE_SECONDS before each run so rows committed late (the
+write-behind buffer, long transactions) are still picked up; a stop landing
+days after its start simply marks that older day dirty again.
+
+Run it with `manage.py rollup_stats` from cron; the first run, which folds
+in all of history, must be done that way. After that the dashboard APIs
+call `maybe_rollup`, which starts an incremental run in a background
+thread at most every ROLLUP_SECONDS; requests only ever read the rollups.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+OPEN_DAYS = 2
+CHART_RANGES = (7, 30, 90, 365)
+MOVIE_STATS_CHECKPOINT = "movie_stats"
+REBUILD_BATCH = 500  # movies per rebuild query
+
+
+def dashboard_tz():
+    return ZoneInfo(getattr(settings, "DASHBOARD_TIME_ZONE", settings.TIME_ZONE))
+
+
+def local_today(tz=None):
+    return timezone.now().astimezone(tz or dashboard_tz()).date()
+
+
+def day_start(day, tz):
+    """Aware datetime of local midnight starting `day`."""
+    return datetime.combine(day, time.min, tzinfo=tz)
+
+
+def compute_daily_visits(first_day, last_day, tz=None):
+    """{day: (visits, visitors)} for first_day..last_day, straight from WatchHistory."""
+    from movies.models import WatchHistory
+
+    tz = tz or dashboard_tz()
+    rows = (
+        WatchHistory.objects.filter(
+            start_time__gte=day_start(first_day, tz),
+            start_time__lt=day_start(last_day + timedelta(days=1), tz),
+        )
+        .annotate(day=TruncDate("start_time", tzinfo=tz))
+        .values("day")
+        .annotate(visits=Count("id"), visitors=Count("ip_address", distinct=True))
+        .order_by()
+    )
+    return {r["day"]: (r["visits"], r["visitors"]) for r in rows}
+
+
+def store_daily_visits(first_day, last_day, tz=None):
+    """(Re)compute and save the rollup rows of first_day..last_day, empty days included."""
+    from movies.models import DailyVisitStats
+
+    counts = compute_daily_visits(first_day, last_day, tz)
+    now = timezone.now()
+    rows = []
+    day = first_day
+    while day <= last_day:
+        visits, visitors = counts.get(day, (0, 0))
+        rows.append(DailyVisitStats(day=day, visits=visits, visitors=visitors, computed_at=now))
+        day += timedelta(days=1)
+    DailyVisitStats.objects.bulk_create(
+        rows,
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=["day"],
+        update_fields=["visits", "visitors", "computed_at"],
+    )
+    return counts
+
+
+def daily_visit_series(days):
+    """
+    [(day, visits, visitors)] for the last `days` local days, oldest first,
+    with zeros for days without plays.
+    """
+    from movies.models import DailyVisitStats
+
+    tz = dashboard_tz()
+    today = local_today(tz)
+    first_day = today - timedelta(days=days - 1)
+    open_from = max(first_day, today - timedelta(days=OPEN_DAYS - 1))
+
+    counts = {}
+    if first_day < open_from:
+        closed_until = open_from - timedelta(days=1)
+        stored = {
+            d: (v, u) for d, v, u in DailyVisitStats.objects.filter(day__gte=first_day, day__lte=closed_until)
+            .values_list("day", "visits", "visitors")
+        }
+        missing = [first_day + timedelta(days=i) for i in range((closed_until - first_day).days + 1)
+                   if first_day + timedelta(days=i) not in stored]
+        if missing:
+            stored.update(store_daily_visits(missing[0], missing[-1], tz))
+        counts.update(stored)
+    counts.update(compute_daily_visits(open_from, today, tz))
+
+    return [(first_day + timedelta(days=i),) + counts.get(first_day + timedelta(days=i), (0, 0))
+            for i in range(days)]
+
+
+# ------------------------------------------------------------
+# Per-movie hourly / daily rollups
+# ------------------------------------------------------------
+def dirty_movie_days(since, tz):
+    """{(movie_id, local day)} with raw rows written at or after `since` (everything when None)."""
+    from movies.models import DownloadHistory, WatchHistory
+
+    watches = WatchHistory.objects.filter(start_time__isnull=False)
+    downloads = DownloadHistory.objects.all()
+    if since is not None:
+        watches = watches.filter(last_seen__gte=since)
+        downloads = downloads.filter(downloaded_at__gte=since)
+    watches = watches.annotate(day=TruncDate("start_time", tzinfo=tz)).values_list("movie_id", "day").order_by()
+    downloads = downloads.annotate(day=TruncDate("downloaded_at", tzinfo=tz)).values_list("movie_id", "day").order_by()
+    if since is None:
+        return set(watches.distinct()) | set(downloads.distinct())
+    # few changed rows: dedupe here, as a SQL DISTINCT makes SQLite walk the
+    # whole movie_id index instead of the time range
+    return set(watches) | set(downloads)
+
+
+def _aggregate_day(movie_ids, start, end, tz):
+    """{(movie_id, period, bucket): {field: value}} for one local day of `movie_ids`."""
+    from movies.models import DownloadHistory, MovieStatsRollup, WatchHistory
+
+    stats = defaultdict(lambda: {"plays": 0, "downloads": 0, "watch_seconds": 0, "unique_ips": 0})
+    watches = WatchHistory.objects.filter(movie_id__in=movie_ids, start_time__gte=start, start_time__lt=end)
+    downloads = DownloadHistory.objects.filter(movie_id__in=movie_ids, downloaded_at__gte=start, downloaded_at__lt=end)
+
+    for period, group in ((MovieStatsRollup.HOUR, ("movie_id", "bucket")), (MovieStatsRollup.DAY, ("movie_id",))):
+        rows = (
+            watches.annotate(bucket=TruncHour("start_time", tzinfo=tz)).values(*group)
+            .annotate(plays=Count("id"), watched=Sum("duration"), ips=Count("ip_address", distinct=True))
+            .order_by()
+        )
+        for r in rows:
+            entry = stats[(r["movie_id"], period, r.get("bucket", start))]
+            entry["plays"] = r["plays"]
+            entry["watch_seconds"] = int(r["watched"].total_seconds()) if r["watched"] else 0
+            entry["unique_ips"] = r["ips"]
+        rows = (
+            downloads.annotate(bucket=TruncHour("downloaded_at", tzinfo=tz)).values(*group)
+            .annotate(downloads=Count("id")).order_by()
+        )
+        for r in rows:
+            stats[(r["movie_id"], period, r.get("bucket", start))]["downloads"] = r["downloads"]
+    return stats
+
+
+def rebuild_movie_days(pairs, tz=None):
+    """Recompute the hourly and daily rollup rows of every (movie_id, day) in `pairs`."""
+    from movies.models import MovieStatsRollup
+
+    tz = tz or dashboard_tz()
+    by_day = defaultdict(list)
+    for movie_id, day in pairs:
+        by_day[day].append(movie_id)
+
+    for day, movie_ids in sorted(by_day.items()):
+        start, end = day_start(day, tz), day_start(day + timedelta(days=1), tz)
+        for i in range(0, len(movie_ids), REBUILD_BATCH):
+            batch = movie_ids[i:i + REBUILD_BATCH]
+            stats = _aggregate_day(batch, start, end, tz)
+            with transaction.atomic():
+                MovieStatsRollup.objects.filter(movie_id__in=batch, bucket__gte=start, bucket__lt=end).delete()
+                MovieStatsRollup.objects.bulk_create(
+                    [MovieStatsRollup(movie_id=m, period=p, bucket=b, **values) for (m, p, b), values in stats.items()],
+                    batch_size=500,
+                )
+
+
+def rollup_movie_stats(full=False):
+    """
+    Fold raw rows written since the last run into the rollups. Returns the
+    number of (movie, day) pairs rebuilt. `full` rebuilds everything.
+    """
+    from movies.models import RollupCheckpoint
+
+    tz = dashboard_tz()
+    started = timezone.now()
+    checkpoint = RollupCheckpoint.objects.filter(name=MOVIE_STATS_CHECKPOINT).first()
+    since = None
+    if checkpoint is not None and not full:
+        since = checkpoint.high_water - timedelta(seconds=getattr(settings, "ROLLUP_LATE_SECONDS", 300))
+
+    pairs = dirty_movie_days(since, tz)
+    rebuild_movie_days(pairs, tz)
+    # closed days in the site-wide table, one query per run of consecutive days
+    closed_until = local_today(tz) - timedelta(days=OPEN_DAYS)
+    days = sorted({day for _, day in pairs if day <= closed_until})
+    run_start = None
+    for i, day in enumerate(days):
+        run_start = run_start or day
+        if i + 1 == len(days) or days[i + 1] != day + timedelta(days=1):
+            store_daily_visits(run_start, day, tz)
+            run_start = None
+
+    RollupCheckpoint.objects.update_or_create(name=MOVIE_STATS_CHECKPOINT, defaults={"high_water": started})
+    return len(pairs)
+
+
+_rollup_thread = None
+
+
+def maybe_rollup():
+    """
+    Start an incremental `rollup_movie_stats` in a background thread if
+    nobody ran one in the last ROLLUP_SECONDS (default 60). Never blocks the
+    caller, and never does the initial full build (`manage.py rollup_stats`).
+    True when a run was started.
+    """
+    global _rollup_thread
+    from movies.models import RollupCheckpoint
+
+    if _rollup_thread is not None and _rollup_thread.is_alive():
+        return False
+    if not RollupCheckpoint.objects.filter(name=MOVIE_STATS_CHECKPOINT).exists():
+        return False
+    if not cache.add("rollups:movie_stats", 1, getattr(settings, "ROLLUP_SECONDS", 60)):
+        return False
+    _rollup_thread = threading.Thread(target=_background_rollup, name="stats-rollup", daemon=True)
+    _rollup_thread.start()
+    return True
+
+
+def _background_rollup():
+    try:
+        rollup_movie_stats()
+    except Exception:
+        logger.exception("Background stats rollup failed")
+    finally:
+        connection.close()  # runs in its own thread
+
+
+def movie_stats_totals(days=None):
+    """
+    Queryset of {movie_id, plays, downloads, watch_seconds} summed over the
+    last `days` local days (all time when None), read from the daily rollups.
+    """
+    from movies.models import MovieStatsRollup
+
+    qs = MovieStatsRollup.objects.filter(period=MovieStatsRollup.DAY)
+    if days:
+        tz = dashboard_tz()
+        qs = qs.filter(bucket__gte=day_start(local_today(tz) - timedelta(days=days - 1), tz))
+    return qs.values("movie_id").annotate(
+        plays=Sum("plays"), downloads=Sum("downloads"), watch_seconds=Sum("watch_seconds"),
+    ).order_by()
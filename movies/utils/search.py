@@ -0,0 +1,131 @@
+# movies/utils/search.py
+"""
+Movie search used by the home page `q` filter and the live suggestions box.
+
+PostgreSQL: a GIN full-text index over name/description/genre (prefix
+matching, so partially typed words hit) combined with pg_trgm word
+similarity on `name` for typo tolerance. Both are index backed, see
+migration 0019_movie_search_indexes.
+
+Other databases (local SQLite runs): icontains over the same columns with a
+simple rank, plus a difflib pass over title words when nothing matches exactly.
+"""
+import difflib
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+MAX_QUERY_LENGTH = 100
+MAX_QUERY_TOKENS = 8
+FUZZY_MAX_RESULTS = 50
+
+# Must stay byte-for-byte identical to the expression of the
+# `movie_search_document_idx` index, otherwise PostgreSQL will not use it.
+SEARCH_DOCUMENT_SQL = (
+    "to_tsvector('simple', coalesce(name, '') || ' ' || "
+    "coalesce(description, '') || ' ' || coalesce(genre, ''))"
+)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(query):
+    query = (query or "").strip()[:MAX_QUERY_LENGTH]
+    return _TOKEN_RE.findall(query.lower())[:MAX_QUERY_TOKENS]
+
+
+def search_movies(queryset, query, ranked=True):
+    """
+    Filter `queryset` down to movies matching `query`.
+    With `ranked=True` the best matches come first; otherwise the caller's
+    ordering is left alone (e.g. keyset-paginated catalog).
+    """
+    query = (query or "").strip()[:MAX_QUERY_LENGTH]
+    tokens = tokenize(query)
+    if not tokens:
+        return queryset.none()
+    if connection.vendor == "postgresql":
+        return _postgres_search(queryset, query, tokens, ranked)
+    return _fallback_search(queryset, query, tokens, ranked)
+
+
+def _postgres_search(queryset, query, tokens, ranked):
+    from django.contrib.postgres.search import (
+        SearchQuery,
+        SearchRank,
+        SearchVectorField,
+        TrigramWordSimilarity,
+    )
+
+    # "rwa film" -> 'rwa':* & 'film':*  (tokens are \w+ only, safe to quote)
+    tsquery = SearchQuery(
+        " & ".join(f"'{t}':*" for t in tokens),
+        search_type="raw",
+        config="simple",
+    )
+    queryset = queryset.alias(
+        document=RawSQL(SEARCH_DOCUMENT_SQL, [], output_field=SearchVectorField()),
+    ).filter(Q(document=tsquery) | Q(name__trigram_word_similar=query))
+
+    if not ranked:
+        return queryset
+    return queryset.annotate(
+        rank=SearchRank(F("document"), tsquery) + TrigramWordSimilarity(query, "name"),
+    ).order_by("-rank", "-download_count", "-id")
+
+
+def _fold(text):
+    """Casefolded, accents stripped: "Été" -> "ete"."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _close_title_ids(queryset, tokens):
+    """
+    Typo tolerance: ids of movies where every query token is close (difflib)
+    to some folded word of the title, so "ete kigalo" finds "Été à Kigali 6".
+    Titles are streamed once into a word -> ids map; difflib only compares
+    the distinct words.
+    """
+    words = {}
+    for movie_id, name in queryset.values_list("id", "name").order_by().iterator():
+        for word in _TOKEN_RE.findall(_fold(name)):
+            words.setdefault(word, set()).add(movie_id)
+    ids = None
+    for token in tokens:
+        hits = set()
+        for word in difflib.get_close_matches(_fold(token), list(words), n=10, cutoff=0.75):
+            hits |= words[word]
+        ids = hits if ids is None else ids & hits
+        if not ids:
+            return []
+    return list(ids)[:FUZZY_MAX_RESULTS]
+
+
+def _fallback_search(queryset, query, tokens, ranked):
+    condition = Q()
+    for token in tokens:
+        condition &= (
+            Q(name__icontains=token)
+            | Q(genre__icontains=token)
+            | Q(description__icontains=token)
+        )
+    matches = queryset.filter(condition)
+
+    if not matches.exists():
+        matches = queryset.filter(id__in=_close_title_ids(queryset, tokens))
+
+    if not ranked:
+        return matches
+    return matches.annotate(
+        rank=Case(
+            When(name__istartswith=query, then=Value(3)),
+            When(name__icontains=query, then=Value(2)),
+            When(genre__icontains=query, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+    ).order_by("-rank", "-download_count", "-id")
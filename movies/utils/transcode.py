@@ -0,0 +1,356 @@
+# movies/utils/transcode.py
+"""
+Database-backed transcode queue.
+
+Only uploaded videos are converted: a `video_url` under MEDIA_URL whose
+file is in MEDIA_ROOT. External video URLs already play as they are and
+are never queued. The worker writes its output into MEDIA_ROOT, so it has
+to run on the machine (or disk) the site serves MEDIA_ROOT from; on
+Render it runs inside the web service (render.yaml).
+
+`Movie.save()` only inserts a TranscodeJob; a partial unique constraint
+keeps at most one pending/running job per movie, so saving again while one
+is queued is a no-op. Conversion happens in `manage.py run_transcode_worker`.
+
+Claiming is a conditional UPDATE:
+
+    UPDATE ... SET status='running', locked_by=<worker>, attempts=attempts+1
+    WHERE id=<candidate> AND (due pending job OR running job with expired lease)
+
+Only one worker's UPDATE can match a row, so any number of workers may poll
+the same table, on PostgreSQL or SQLite. Workers renew `locked_at` while a
+job runs; the job of a worker that died is claimed again once its lease
+(TRANSCODE_LEASE_SECONDS, default 15 min) runs out.
+
+A failed attempt is retried after TRANSCODE_RETRY_SECONDS * 2**(attempt-1)
+(60s, 2 min, 4 min, ...) until TRANSCODE_MAX_ATTEMPTS (default 3) is
+reached, then the job is marked failed; saving the movie queues a new one.
+`Movie.transcode_status` follows the job.
+
+A job probes the source, stores codec, resolution, duration and bitrate
+on the movie, and produces an MP4 fallback and an HLS ladder of HLS_LADDER
+renditions with ffmpeg from imageio-ffmpeg, under MEDIA_ROOT; the watch
+page plays the ladder adaptively. Uploads already in H.264/AAC are only
+remuxed into the MP4 (stream copy, +faststart) instead of re-encoded.
+"""
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+from datetime import timedelta
+from urllib.parse import unquote, urlparse
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from imageio_ffmpeg import get_ffmpeg_exe
+
+logger = logging.getLogger(__name__)
+
+# (height, video kbps, audio kbps); override with HLS_LADDER
+HLS_LADDER = ((240, 400, 64), (360, 800, 96), (720, 2800, 128))
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def lease_seconds():
+    return getattr(settings, "TRANSCODE_LEASE_SECONDS", 15 * 60)
+
+
+def enqueue(movie):
+    """Queue a conversion of `movie`. False when one is already queued or running."""
+    from movies.models import Movie, TranscodeJob
+
+    try:
+        with transaction.atomic():
+            TranscodeJob.objects.create(movie=movie)
+    except IntegrityError:
+        return False
+    Movie.objects.filter(id=movie.id).update(transcode_status=TranscodeJob.PENDING)
+    movie.transcode_status = TranscodeJob.PENDING
+    return True
+
+
+def _claimable(now):
+    from movies.models import TranscodeJob
+
+    return (Q(status=TranscodeJob.PENDING, run_after__lte=now)
+            | Q(status=TranscodeJob.RUNNING, locked_at__lt=now - timedelta(seconds=lease_seconds())))
+
+
+def claim(worker, limit=1):
+    """Claim up to `limit` due jobs for `worker`; returns them with their movies."""
+    from movies.models import Movie, TranscodeJob
+
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    candidates = (TranscodeJob.objects.filter(_claimable(now))
+                  .order_by("run_after", "id").values_list("id", flat=True)[:limit * 4])
+    claimed = []
+    for job_id in candidates:
+        updated = TranscodeJob.objects.filter(_claimable(now), id=job_id).update(
+            status=TranscodeJob.RUNNING, locked_by=worker, locked_at=now, attempts=F("attempts") + 1,
+        )
+        if updated:
+            claimed.append(job_id)
+            if len(claimed) == limit:
+                break
+    if not claimed:
+        return []
+    Movie.objects.filter(transcode_jobs__in=claimed).update(transcode_status=TranscodeJob.RUNNING)
+    return list(TranscodeJob.objects.filter(id__in=claimed).select_related("movie"))
+
+
+def renew(worker):
+    """Extend the lease of every job `worker` is running."""
+    from movies.models import TranscodeJob
+
+    return TranscodeJob.objects.filter(status=TranscodeJob.RUNNING, locked_by=worker).update(locked_at=timezone.now())
+
+
+def run_job(job, worker):
+    """Convert one claimed job and record the outcome. True on success."""
+    try:
+        if uploaded_source(job.movie) is None:
+            # queued before only uploads were converted, or the file is gone
+            logger.warning("Transcode job %s: movie %s has no uploaded video, nothing to convert",
+                           job.id, job.movie_id)
+            _finish(job, worker, movie_status="")
+            return False
+        transcode_movie(job.movie)
+    except Exception as exc:
+        logger.exception("Transcode of movie %s failed (attempt %s)", job.movie_id, job.attempts)
+        _fail(job, worker, exc)
+        return False
+    else:
+        _finish(job, worker)
+        return True
+    finally:
+        connection.close()  # runs in a worker thread
+
+
+def _owned(job, worker):
+    from movies.models import TranscodeJob
+
+    return TranscodeJob.objects.filter(id=job.id, status=TranscodeJob.RUNNING, locked_by=worker)
+
+
+def _finish(job, worker, movie_status=None):
+    from movies.models import Movie, TranscodeJob
+
+    if not _owned(job, worker).update(status=TranscodeJob.DONE, finished_at=timezone.now(), last_error=""):
+        logger.warning("Transcode job %s finished after its lease was taken over", job.id)
+    Movie.objects.filter(id=job.movie_id).update(
+        transcode_status=TranscodeJob.DONE if movie_status is None else movie_status)
+
+
+def _fail(job, worker, exc):
+    from movies.models import Movie, TranscodeJob
+
+    now = timezone.now()
+    error = f"{type(exc).__name__}: {exc}"[:2000]
+    if job.attempts < getattr(settings, "TRANSCODE_MAX_ATTEMPTS", 3):
+        delay = getattr(settings, "TRANSCODE_RETRY_SECONDS", 60) * 2 ** (job.attempts - 1)
+        status, changes = TranscodeJob.PENDING, {"run_after": now + timedelta(seconds=delay)}
+    else:
+        status, changes = TranscodeJob.FAILED, {"finished_at": now}
+    if _owned(job, worker).update(status=status, locked_by="", locked_at=None, last_error=error, **changes):
+        Movie.objects.filter(id=job.movie_id).update(transcode_status=status)
+
+
+def uploaded_source(movie):
+    """Path in MEDIA_ROOT of the movie's video when it is an uploaded file (under MEDIA_URL), else None."""
+    media_root, media_url = str(settings.MEDIA_ROOT), settings.MEDIA_URL
+    if not (movie.video_url and media_url):
+        return None
+    url = movie.video_url if urlparse(media_url).netloc else urlparse(movie.video_url).path
+    if not url.startswith(media_url):
+        return None
+    source = os.path.realpath(os.path.join(media_root, unquote(url[len(media_url):])))
+    if not source.startswith(os.path.realpath(media_root) + os.sep) or not os.path.isfile(source):
+        return None
+    return source
+
+
+def source_paths(movie):
+    """(ffmpeg input, output base path): the uploaded video, converted next to the original."""
+    source = uploaded_source(movie)
+    if source is None:
+        raise ValueError(f"Movie {movie.id}: {movie.video_url} is not an uploaded file under MEDIA_URL")
+    return source, os.path.splitext(source)[0]
+
+
+def probe(source):
+    """
+    Container, duration, bitrate and stream details of a video, parsed from
+    `ffmpeg -i` (imageio-ffmpeg ships no ffprobe):
+    {"format", "duration", "bitrate", "video_codec", "pix_fmt", "width",
+     "height", "audio_codec", "has_audio"}; unknown numbers are None.
+    """
+    result = subprocess.run([get_ffmpeg_exe(), "-hide_banner", "-i", source],
+                            capture_output=True, text=True, errors="replace")
+    out = result.stderr
+    video = re.search(r"Stream #.*Video: (\w+)[^,\n]*, (\w+).*?\b(\d{2,5})x(\d{2,5})\b", out)
+    if video is None:
+        raise ValueError(f"No video stream found in {source}")
+    container = re.search(r"Input #0, (\S+), from", out)
+    duration = re.search(r"Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)", out)
+    bitrate = re.search(r"Duration:.*bitrate: (\d+) kb/s", out)
+    audio = re.search(r"Stream #.*Audio: (\w+)", out)
+    return {
+        "format": container.group(1) if container else "",
+        "duration": (int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3))
+                     if duration else None),
+        "bitrate": int(bitrate.group(1)) if bitrate else None,
+        "video_codec": video.group(1),
+        "pix_fmt": video.group(2),
+        "width": int(video.group(3)),
+        "height": int(video.group(4)),
+        "audio_codec": audio.group(1) if audio else "",
+        "has_audio": audio is not None,
+    }
+
+
+def save_probe(movie, info):
+    """Store what `probe` found on the movie."""
+    from movies.models import Movie
+
+    fields = {
+        "video_codec": info["video_codec"],
+        "audio_codec": info["audio_codec"],
+        "video_width": info["width"],
+        "video_height": info["height"],
+        "duration_seconds": info["duration"],
+        "bitrate_kbps": info["bitrate"],
+    }
+    Movie.objects.filter(id=movie.id).update(**fields)
+    for name, value in fields.items():
+        setattr(movie, name, value)
+
+
+def can_remux(info):
+    """True when the streams already are what browsers play in MP4: H.264 (4:2:0) and AAC or no audio."""
+    return (info["video_codec"] == "h264" and info["pix_fmt"] in ("yuv420p", "yuvj420p")  # 8-bit only
+            and info["audio_codec"] in ("", "aac"))
+
+
+def remux_mp4(source, output_path):
+    """Copy the first video and audio stream into an MP4 with the moov atom first, no re-encoding."""
+    cmd = [get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", "-i", source,
+           "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy", "-movflags", "+faststart", output_path]
+    result = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.strip()[-1000:]}")
+
+
+def hls_ladder(source_height):
+    """The HLS_LADDER rungs (height, video kbps, audio kbps) not above the source, at least one."""
+    ladder = sorted(getattr(settings, "HLS_LADDER", HLS_LADDER))
+    return [rung for rung in ladder if rung[0] <= source_height] or ladder[:1]
+
+
+def build_hls(source, out_dir, info=None):
+    """
+    Encode `source` into one HLS rendition per ladder rung with aligned
+    keyframes, plus `master.m3u8`, in a single ffmpeg run. The directory is
+    built as `<out_dir>.part` and renamed into place once complete.
+    """
+    info = info or probe(source)
+    rungs = hls_ladder(info["height"])
+    seconds = getattr(settings, "HLS_SEGMENT_SECONDS", 4)
+    tmp = out_dir + ".part"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    split = f"[0:v]split={len(rungs)}" + "".join(f"[s{i}]" for i in range(len(rungs)))
+    scales = [f"[s{i}]scale=-2:{height}[v{i}]" for i, (height, _, _) in enumerate(rungs)]
+    cmd = [get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", "-i", source,
+           "-filter_complex", ";".join([split] + scales)]
+    streams = []
+    for i, (height, video_kbps, audio_kbps) in enumerate(rungs):
+        cmd += ["-map", f"[v{i}]", f"-c:v:{i}", "libx264", f"-b:v:{i}", f"{video_kbps}k",
+                f"-maxrate:v:{i}", f"{video_kbps * 107 // 100}k", f"-bufsize:v:{i}", f"{video_kbps * 2}k"]
+        if info["has_audio"]:
+            cmd += ["-map", "0:a:0", f"-c:a:{i}", "aac", f"-b:a:{i}", f"{audio_kbps}k"]
+            streams.append(f"v:{i},a:{i},name:{height}p")
+        else:
+            streams.append(f"v:{i},name:{height}p")
+    if info["has_audio"]:
+        cmd += ["-ac", "2"]
+    cmd += ["-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-force_key_frames", f"expr:gte(t,n_forced*{seconds})",
+            "-f", "hls", "-hls_time", str(seconds), "-hls_playlist_type", "vod",
+            "-hls_flags", "independent_segments",
+            "-hls_segment_filename", os.path.join(tmp, "%v", "seg_%04d.ts"),
+            "-master_pl_name", "master.m3u8",
+            "-var_stream_map", " ".join(streams),
+            os.path.join(tmp, "%v", "index.m3u8")]
+    result = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    if result.returncode != 0:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.strip()[-1000:]}")
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp, out_dir)
+    return [f"{height}p" for height, _, _ in rungs]
+
+
+def transcode_movie(movie):
+    """
+    Probe the movie's video, store what was found, then produce its playback
+    files, skipping whatever already exists:
+      - a universal MP4 (H.264 + AAC, moov atom first), `converted_video`,
+        for players without HLS and for downloads; compatible uploads are
+        only remuxed, in seconds, everything else is re-encoded
+      - the HLS ladder in `<base>_hls/`, `hls_playlist`
+    The MP4 is saved first, so the movie plays while the ladder is built.
+    """
+    from movies.models import Movie
+
+    source, base = source_paths(movie)
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    media_root = str(settings.MEDIA_ROOT)
+    info = probe(source)
+    save_probe(movie, info)
+
+    if not movie.converted_video:
+        output_path = base + "_converted.mp4"
+        partial_path = base + "_converted.part.mp4"  # renamed once complete
+        if can_remux(info):
+            remux_mp4(source, partial_path)
+        else:
+            from moviepy.editor import VideoFileClip
+
+            clip = VideoFileClip(source)
+            try:
+                clip.write_videofile(
+                    partial_path,
+                    codec='libx264',
+                    audio_codec='aac',
+                    temp_audiofile=base + "_temp-audio.m4a",  # per movie: workers convert in parallel
+                    remove_temp=True,
+                    ffmpeg_params=["-movflags", "+faststart"],
+                    logger=None,
+                )
+            finally:
+                clip.close()
+        os.replace(partial_path, output_path)
+
+        relative_path = os.path.relpath(output_path, media_root)
+        Movie.objects.filter(id=movie.id).update(converted_video=relative_path)
+        movie.converted_video.name = relative_path
+        logger.info("Movie %s: MP4 %s", movie.id, "remuxed" if can_remux(info) else "re-encoded")
+
+    if not movie.hls_playlist:
+        out_dir = base + "_hls"
+        renditions = build_hls(source, out_dir, info)
+        playlist = os.path.relpath(os.path.join(out_dir, "master.m3u8"), media_root).replace(os.sep, "/")
+        Movie.objects.filter(id=movie.id).update(hls_playlist=playlist)
+        movie.hls_playlist = playlist
+        logger.info("Movie %s: HLS %s", movie.id, ", ".join(renditions))
@@ -0,0 +1,69 @@
+# movies/utils/visitors.py
+"""
+Visitor bookkeeping in a single statement.
+
+Every play counts as a visit: `INSERT ... ON CONFLICT (ip_address) DO
+UPDATE` creates the Visitor row or bumps `visit_count`/`last_visit` of the
+existing one atomically, so concurrent plays from one address neither race
+nor lose increments. A known location is written as well; an empty one
+never overwrites a location found earlier.
+
+Works on PostgreSQL and SQLite (3.24+), the two backends this project runs on.
+"""
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from movies.utils.geohash import encode as geohash_encode
+
+UPSERT_BATCH = 500
+
+# one address' activity in a batch
+Visit = namedtuple("Visit", "count last_seen location")
+
+EMPTY_LOCATION = ("", "", 0.0, 0.0)
+
+
+def record_visit(ip, seen=None, location=None):
+    """Count one visit from `ip`: a single INSERT ... ON CONFLICT statement."""
+    record_visits({ip: Visit(1, seen or timezone.now(), location)})
+
+
+def record_visits(visits):
+    """
+    Bulk variant of `record_visit`. `visits` maps ip -> Visit(count,
+    last_seen, location); one statement per UPSERT_BATCH addresses.
+    """
+    from movies.models import Visitor
+
+    if not visits:
+        return
+    qn = connection.ops.quote_name
+    table = qn(Visitor._meta.db_table)
+    columns = ("ip_address", "country", "city", "lat", "lng", "geohash",
+               "first_visit", "last_visit", "known", "visit_count")
+    keep_if_blank = "CASE WHEN EXCLUDED.country <> '' THEN EXCLUDED.{col} ELSE {table}.{col} END"
+    updates = [
+        f"{qn('visit_count')} = {table}.{qn('visit_count')} + EXCLUDED.{qn('visit_count')}",
+        f"{qn('last_visit')} = CASE WHEN EXCLUDED.{qn('last_visit')} > {table}.{qn('last_visit')} "
+        f"THEN EXCLUDED.{qn('last_visit')} ELSE {table}.{qn('last_visit')} END",
+    ] + [f"{qn(col)} = " + keep_if_blank.format(col=qn(col), table=table) for col in ("country", "city", "lat", "lng", "geohash")]
+
+    items = list(visits.items())
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), UPSERT_BATCH):
+                batch = items[start:start + UPSERT_BATCH]
+                params = []
+                for ip, visit in batch:
+                    country, city, lat, lng = visit.location or EMPTY_LOCATION
+                    seen = connection.ops.adapt_datetimefield_value(visit.last_seen)
+                    params += [ip, country or "", city or "", lat or 0.0, lng or 0.0, geohash_encode(lat, lng),
+                               seen, seen, False, visit.count]
+                placeholders = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(batch))
+                cursor.execute(
+                    f"INSERT INTO {table} ({', '.join(qn(c) for c in columns)}) VALUES {placeholders} "
+                    f"ON CONFLICT ({qn('ip_address')}) DO UPDATE SET {', '.join(updates)}",
+                    params,
+                )
@@ -1,101 +1,204 @@
 # movies/views.py
+import uuid
+from collections import Counter
 from django.utils.timezone import now
 from datetime import timedelta
 from django.utils import timezone
 from django.utils.timesince import timesince
 from django.shortcuts import render, get_object_or_404, redirect
-from django.db.models import Q, Count, F
-from django.http import JsonResponse, HttpResponse
+from django.db.models import Q, Count, Exists, Max, OuterRef, Subquery
+from django.core.paginator import Paginator
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import condition
 from django.db import transaction
 
-from .models import Movie, Comment, WatchHistory, Visitor, DownloadHistory
-from .utils.ip_tracker import get_client_ip, get_geoip_location
+from .models import Movie, Comment, WatchHistory, Visitor, VisitorMapCell, DownloadHistory
+from .utils.ip_tracker import get_client_ip
+from .utils.enrichment import geo_queue
+from .utils.exports import (
+    CONTENT_TYPES as EXPORT_CONTENT_TYPES, FORMATS as EXPORT_FORMATS,
+    aiter_blocks, export_queryset, export_sources, iter_export, parse_bound,
+)
+from .utils.geohash import cell_size, precision_for_zoom
+from .utils.rollups import CHART_RANGES, daily_visit_series, maybe_rollup, movie_stats_totals
+from .utils.pagination import keyset_page, normalize_sort
+from .utils.search import search_movies
+from .utils.autocomplete import title_index
+from .utils.events import hub
+from .utils import counters, presence
+from .utils.ingest import new_session_key, watch_events
+from .utils.cache import COMMENTS_VERSION, MOVIES_VERSION, cache_anonymous_page, get_or_refresh, get_version
 
 TRENDING_LIMIT = 8
 NEW_RELEASES_LIMIT = 8
 MAIN_PAGE_LIMIT = 20
+CATALOG_MAX_LIMIT = 60
 ACTIVE_WINDOW_MINUTES = 10
-
-
-def _safe_geoip(ip):
-    """Safe GeoIP lookup wrapper."""
-    try:
-        return get_geoip_location(ip)
-    except Exception:
-        return "", "", 0.0, 0.0
+COMMENT_COUNTS_MAX_IDS = 200
+SUGGESTIONS_LIMIT = 5
+LATEST_MOVIES_LIMIT = 50
+COMMENTS_PAGE_SIZE = 30
 
 
 # ============================================================
 # Home Page
 # ============================================================
-def home(request):
-    """
-    Homepage view: shows trending, new releases, and all movies.
-    Provides genre list for filter dropdown.
-    """
-    # --- Get query params ---
-    search_query = request.GET.get('q', '').strip()
-    selected_genre = request.GET.get('genre', '').strip()
-    selected_sort = request.GET.get('sort', '').strip()
-
-    # --- Base queryset ---
+def _catalog_queryset(search_query, selected_genre):
+    """Movies matching the home page search box and genre filter."""
     movies_qs = Movie.objects.all()
 
     # --- Search filter ---
     if search_query:
-        movies_qs = movies_qs.filter(name__icontains=search_query)
+        movies_qs = search_movies(movies_qs, search_query, ranked=False)
 
     # --- Genre filter ---
     if selected_genre:
         movies_qs = movies_qs.filter(genre__iexact=selected_genre)
 
-    # --- Sorting ---
-    if selected_sort == 'trending':
-        # trending = most downloaded
-        movies_qs = movies_qs.order_by('-download_count', '-uploaded_at')
-    elif selected_sort == 'new':
-        movies_qs = movies_qs.order_by('-uploaded_at')
-    else:
-        movies_qs = movies_qs.order_by('-uploaded_at')
+    return movies_qs
+
+
+def _movie_card(m):
+    """JSON shape of a movie card, shared by the catalog and live feeds."""
+    return {
+        'id': m.id,
+        'name': m.name,
+        'image_url': m.image_url or '',
+        'genre': m.genre or '',
+        'download_url': m.download_url or '',
+        'uploaded_at': m.uploaded_at.isoformat() if m.uploaded_at else '',
+        'comment_count': m.comment_count,
+    }
+
+
+def _home_sections():
+    """Trending, new releases, genre list and total: identical for every visitor."""
+    def build():
+        return {
+            'trending_movies': list(Movie.objects.order_by('-download_count', '-uploaded_at')[:6]),
+            'new_releases': list(Movie.objects.order_by('-uploaded_at')[:6]),
+            'genres': list(
+                Movie.objects.exclude(genre__isnull=True)
+                             .exclude(genre__exact='')
+                             .values_list('genre', flat=True)
+                             .distinct()
+                             .order_by('genre')
+            ),
+            'total_movies': Movie.objects.count(),
+            'latest_movie_id': Movie.objects.aggregate(last=Max('id'))['last'] or 0,
+        }
+    return get_or_refresh('home:sections', build)
+
 
-    # --- Separate sections ---
-    trending_movies = Movie.objects.order_by('-download_count', '-uploaded_at')[:6]
-    new_releases = Movie.objects.order_by('-uploaded_at')[:6]
-    all_movies = movies_qs
+@cache_anonymous_page()
+def home(request):
+    """
+    Homepage view: shows trending, new releases, and the first page of the
+    catalog (further pages are loaded from `catalog_api` on scroll).
+    Provides genre list for filter dropdown.
+    """
+    # --- Get query params ---
+    search_query = request.GET.get('q', '').strip()
+    selected_genre = request.GET.get('genre', '').strip()
+    selected_sort = request.GET.get('sort', '').strip()
 
-    # --- Unique genres for dropdown ---
-    all_genres = Movie.objects.exclude(genre__isnull=True)\
-                          .exclude(genre__exact='')\
-                          .values_list('genre', flat=True)\
-                          .distinct()\
-                          .order_by('genre')
-    
-    all_genres = Movie.objects.exclude(genre__isnull=True).exclude(genre__exact='').values_list('genre', flat=True).distinct().order_by('genre')
+    # --- First catalog page (keyset paginated) ---
+    movies_qs = _catalog_queryset(search_query, selected_genre)
+    all_movies, next_cursor = keyset_page(movies_qs, normalize_sort(selected_sort), None, MAIN_PAGE_LIMIT)
 
+    # --- Separate sections (trending, new releases, genres, total) ---
+    sections = _home_sections()
 
     context = {
         'search_query': search_query,
         'selected_genre': selected_genre,
         'selected_sort': selected_sort,
-        'trending_movies': trending_movies,
-        'new_releases': new_releases,
+        'trending_movies': sections['trending_movies'],
+        'new_releases': sections['new_releases'],
         'movies': all_movies,
-        'genres': all_genres,  # for your <select> in template
-        'total_movies': Movie.objects.count(),
+        'next_cursor': next_cursor or '',
+        'genres': sections['genres'],  # for your <select> in template
+        'total_movies': sections['total_movies'],
+        'latest_movie_id': sections['latest_movie_id'],  # cursor for the `latest_movies` delta feed
     }
 
     return render(request, 'movies/home.html', context)
 
+
+def catalog_api(request):
+    """
+    Keyset-paginated catalog for infinite scroll.
+
+    GET ?cursor=<token>&sort=new|trending&q=&genre=&limit=
+    Returns {"movies": [...], "next_cursor": <token or null>}.
+    """
+    search_query = request.GET.get('q', '').strip()
+    selected_genre = request.GET.get('genre', '').strip()
+    sort = normalize_sort(request.GET.get('sort', '').strip())
+    try:
+        limit = max(1, min(int(request.GET.get('limit', MAIN_PAGE_LIMIT)), CATALOG_MAX_LIMIT))
+    except ValueError:
+        limit = MAIN_PAGE_LIMIT
+
+    movies_qs = _catalog_queryset(search_query, selected_genre)
+    movies, next_cursor = keyset_page(movies_qs, sort, request.GET.get('cursor'), limit)
+    return JsonResponse({
+        'movies': [_movie_card(m) for m in movies],
+        'next_cursor': next_cursor,
+    })
+
 # ============================================================
 # Watch Movie + Comments
 # ============================================================
-def watch_movie(request, movie_id):
+def _movie_with_stats(movie_id):
+    """
+    Movie row plus its live-viewer count; comment_count and total_views are
+    stored on the row, live viewers come from the presence tracker (cached).
+    """
     movie = get_object_or_404(Movie, id=movie_id)
-    last_comment = movie.comment_set.order_by("-id").first()
-    last_comment_id = last_comment.id if last_comment else 0
+    movie.live_viewers = presence.live_count(movie.id)
+    return movie
 
+
+def _comment_json(c):
+    return {
+        "id": c.id,
+        "guest_name": c.guest_name or "",
+        "user": c.user.username if c.user else None,
+        "text": c.text,
+        "created_at_display": timesince(c.created_at) + " ago",
+        "created_at_iso": c.created_at.isoformat(),
+    }
+
+
+def _comment_id(raw):
+    """A comment id cursor from a query parameter or header; 0 for anything non-numeric."""
+    raw = (raw or "").strip()
+    return int(raw) if raw.isdigit() else 0
+
+
+def _older_page(movie_id, before_id=None):
+    """
+    Newest-first page of comments older than `before_id` (or the newest page).
+    Returns (comments, older_cursor); the cursor is None on the last page.
+    """
+    qs = Comment.objects.filter(movie_id=movie_id).select_related("user").order_by("-id")
+    if before_id:
+        qs = qs.filter(id__lt=before_id)
+    comments = list(qs[:COMMENTS_PAGE_SIZE + 1])
+    older_cursor = None
+    if len(comments) > COMMENTS_PAGE_SIZE:
+        comments = comments[:COMMENTS_PAGE_SIZE]
+        older_cursor = comments[-1].id
+    return comments, older_cursor
+
+
+def watch_movie(request, movie_id):
     if request.method == "POST":
+        movie = get_object_or_404(Movie, id=movie_id)
         text = (request.POST.get("text") or "").strip()
         guest_name = (request.POST.get("guest_name") or "").strip()
         if text:
@@ -106,8 +209,9 @@ def watch_movie(request, movie_id):
                 text=text,
             )
             if request.headers.get("x-requested-with") == "XMLHttpRequest":
+                movie.refresh_from_db(fields=["comment_count"])
                 return JsonResponse({
-                    "count": movie.comment_set.count(),
+                    "count": movie.comment_count,
                     "latest_comment": {
                         "id": comment.id,
                         "guest_name": comment.guest_name or "",
@@ -116,19 +220,18 @@ def watch_movie(request, movie_id):
                         "created_at": timesince(comment.created_at) + " ago",
                     },
                 })
-            return redirect("movies:watch_movie", movie_id=movie.id)
+        return redirect("movies:watch_movie", movie_id=movie.id)
 
-    comments = movie.comment_set.select_related("user").order_by("-id")
-    total_views = movie.total_views if hasattr(movie, "total_views") else WatchHistory.objects.filter(movie=movie).count()
-    active_window = timezone.now() - timedelta(minutes=ACTIVE_WINDOW_MINUTES)
-    live_viewers = WatchHistory.objects.filter(movie=movie, end_time__isnull=True, start_time__gte=active_window).count()
+    movie = _movie_with_stats(movie_id)
+    comments, older_cursor = _older_page(movie.id)
 
     return render(request, "movies/watch_movie.html", {
         "movie": movie,
         "comments": comments,
-        "last_comment_id": last_comment_id,
-        "total_views": total_views,
-        "live_viewers": live_viewers,
+        "last_comment_id": comments[0].id if comments else 0,
+        "older_cursor": older_cursor or "",
+        "total_views": movie.total_views,
+        "live_viewers": movie.live_viewers,
     })
 
 
@@ -136,40 +239,104 @@ def watch_movie(request, movie_id):
 # Comments Feed (AJAX)
 # ============================================================
 def comments_feed(request, movie_id):
-    movie = get_object_or_404(Movie, id=movie_id)
-    since_id = int(request.GET.get("since", 0) or 0)
-    qs = movie.comment_set.select_related("user").order_by("id")
-    if since_id > 0:
-        qs = qs.filter(id__gt=since_id)
-
-    comments = [{
-        "id": c.id,
-        "guest_name": c.guest_name or "",
-        "user": c.user.username if c.user else None,
-        "text": c.text,
-        "created_at_display": timesince(c.created_at) + " ago",
-        "created_at_iso": c.created_at.isoformat(),
-    } for c in qs]
-
-    total_views = movie.total_views if hasattr(movie, "total_views") else WatchHistory.objects.filter(movie=movie).count()
-    active_window = timezone.now() - timedelta(minutes=ACTIVE_WINDOW_MINUTES)
-    live_viewers = WatchHistory.objects.filter(movie=movie, end_time__isnull=True, start_time__gte=active_window).count()
+    """
+    GET ?since=<id>   comments newer than <id>, oldest first (bounded)
+    GET ?before=<id>  one page of comments older than <id>, newest first
+    GET               the newest page, oldest first
+    The counters come from the same single movie query.
+    """
+    movie = _movie_with_stats(movie_id)
+    since_id = _comment_id(request.GET.get("since"))
+    before_id = _comment_id(request.GET.get("before"))
+
+    older_cursor = None
+    if before_id > 0:
+        comments, older_cursor = _older_page(movie.id, before_id)
+    elif since_id > 0:
+        comments = list(
+            Comment.objects.filter(movie_id=movie.id, id__gt=since_id)
+            .select_related("user")
+            .order_by("id")[:COMMENTS_PAGE_SIZE]
+        )
+    else:
+        comments, older_cursor = _older_page(movie.id)
+        comments.reverse()
 
     return JsonResponse({
-        "comments": comments,
-        "count": movie.comment_set.count(),
-        "total_views": total_views,
-        "live_viewers": live_viewers,
+        "comments": [_comment_json(c) for c in comments],
+        "older_cursor": older_cursor,
+        "count": movie.comment_count,
+        "total_views": movie.total_views,
+        "live_viewers": movie.live_viewers,
     })
 
 
+# ============================================================
+# Live events (Server-Sent Events, ASGI only)
+# ============================================================
+def _stream_snapshot(movie_id, after_id):
+    """
+    (comments, stats) for the event publisher: comments newer than
+    `after_id` (just the newest one when `after_id` is None) and the counters.
+    """
+    movie = _movie_with_stats(movie_id)
+    qs = Comment.objects.filter(movie_id=movie.id).select_related("user")
+    if after_id is None:
+        comments = list(qs.order_by("-id")[:1])
+    else:
+        comments = list(qs.filter(id__gt=after_id).order_by("id")[:COMMENTS_PAGE_SIZE])
+    stats = {
+        "count": movie.comment_count,
+        "total_views": movie.total_views,
+        "live_viewers": movie.live_viewers,
+    }
+    return [_comment_json(c) for c in comments], stats
+
+
+async def movie_events(request, movie_id):
+    """
+    text/event-stream of new comments ("comments") and counter changes
+    ("stats") for one movie. Needs the ASGI server; under WSGI it answers
+    204 so EventSource gives up and the page keeps polling `comments_feed`.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    if not await Movie.objects.filter(id=movie_id).aexists():
+        return JsonResponse({"error": "Movie not found"}, status=404)
+
+    since_id = _comment_id(request.headers.get("Last-Event-ID") or request.GET.get("since"))
+    response = StreamingHttpResponse(
+        hub.stream(movie_id, since_id, _stream_snapshot),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let a reverse proxy buffer the stream
+    return response
+
+
 # ============================================================
 # Real-Time Viewers API
 # ============================================================
 def real_time_viewers(request, movie_id):
-    active_window = timezone.now() - timedelta(minutes=ACTIVE_WINDOW_MINUTES)
-    count = WatchHistory.objects.filter(movie_id=movie_id, end_time__isnull=True, start_time__gte=active_window).count()
-    return JsonResponse({"count": count})
+    return JsonResponse({"count": presence.live_count(movie_id)})
+
+
+@csrf_exempt
+def watch_heartbeat(request, movie_id):
+    """
+    POST viewer=<watch id>, sent by the player every few seconds while it
+    plays. Keeps the viewer inside the live window; a missed beat or two
+    and they drop out on their own.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Invalid request"}, status=400)
+    viewer = (request.POST.get("viewer") or "").strip()
+    if not viewer:
+        return JsonResponse({"error": "Missing viewer"}, status=400)
+
+    if presence.heartbeat(movie_id, viewer):
+        hub.notify(movie_id)
+    return JsonResponse({"status": "ok"})
 
 
 # ============================================================
@@ -187,7 +354,7 @@ def download_movie(request, movie_id):
             user=request.user if request.user.is_authenticated else None,
             ip_address=ip,
         )
-        Movie.objects.filter(id=movie.id).update(download_count=F("download_count") + 1)
+        counters.increment(movie.id, "download_count")
 
     return redirect(movie.download_url)
 
@@ -196,52 +363,84 @@ def download_movie(request, movie_id):
 # Comment count API
 # ============================================================
 def comment_count_api(request, movie_id):
-    movie = get_object_or_404(Movie, id=movie_id)
-    return JsonResponse({"count": movie.comment_set.count()})
+    count = Movie.objects.filter(id=movie_id).values_list("comment_count", flat=True).first()
+    if count is None:
+        return JsonResponse({"error": "Movie not found"}, status=404)
+    return JsonResponse({"count": count})
+
+
+def _parse_ids(raw, limit):
+    """Parse a comma separated id list ("1,2,3"), ignoring junk and duplicates."""
+    ids = []
+    for part in (raw or "").split(","):
+        part = part.strip()
+        if part.isdigit() and int(part) not in ids:
+            ids.append(int(part))
+        if len(ids) >= limit:
+            break
+    return ids
+
+
+def comment_counts_api(request):
+    """
+    Bulk comment counts for the home page cards.
+
+    GET ?ids=1,2,3&version=<token>
+    `version` is the token returned by the previous call: the COMMENTS_VERSION
+    cache version, bumped by every comment save/delete (movies/signals.py).
+    While it is unchanged the response carries no counts and no query runs.
+    """
+    version = str(get_version(COMMENTS_VERSION))
+    if request.GET.get("version") == version:
+        return JsonResponse({"version": version, "changed": False, "counts": {}})
+
+    ids = _parse_ids(request.GET.get("ids"), COMMENT_COUNTS_MAX_IDS)
+    rows = Movie.objects.filter(id__in=ids).values_list("id", "comment_count") if ids else []
+    return JsonResponse({
+        "version": version,
+        "changed": True,
+        "counts": {str(movie_id): count for movie_id, count in rows},
+    })
 
 
 # ============================================================
 # Watch tracking (start / stop)
 # ============================================================
+def _format_duration(duration):
+    if not duration:
+        return "00:00:00"
+    total_seconds = int(duration.total_seconds())
+    h, m, s = (
+        total_seconds // 3600,
+        (total_seconds % 3600) // 60,
+        total_seconds % 60,
+    )
+    return f"{h:02d}:{m:02d}:{s:02d}"
+
+
 @csrf_exempt
 def start_watch(request, movie_id):
+    """
+    Queue a watch-start event; the row, view counter and visitor are written
+    in bulk by the background flusher (movies/utils/ingest.py).
+    The returned watch_id is the session key used by heartbeat/stop.
+    """
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request"}, status=400)
+    if not Movie.objects.filter(id=movie_id).exists():
+        return JsonResponse({"error": "Movie not found"}, status=404)
 
-    movie = get_object_or_404(Movie, id=movie_id)
-    ip = get_client_ip(request)
-
-    # Close dangling sessions
-    WatchHistory.objects.filter(movie=movie, ip_address=ip, end_time__isnull=True).update(end_time=timezone.now())
-
-    watch = WatchHistory.objects.create(
-        movie=movie,
-        user=request.user if request.user.is_authenticated else None,
-        ip_address=ip,
-        start_time=timezone.now(),
-    )
-
-    Movie.objects.filter(id=movie.id).update(total_views=F("total_views") + 1)
-
-    # Visitor update
-    country, city, lat, lng = _safe_geoip(ip)
-    visitor, _ = Visitor.objects.get_or_create(ip_address=ip, defaults={
-        "country": country,
-        "city": city,
-        "lat": lat,
-        "lng": lng,
-        "last_visit": timezone.now(),
-        "visit_count": 1
-    })
-    if visitor:
-        visitor.country = country or visitor.country
-        visitor.city = city or visitor.city
-        visitor.lat = lat or visitor.lat
-        visitor.lng = lng or visitor.lng
-        visitor.last_visit = timezone.now()
-        visitor.save(update_fields=["country", "city", "lat", "lng", "last_visit"])
-
-    return JsonResponse({"watch_id": watch.id, "status": "started"})
+    session_key = new_session_key()
+    try:
+        watch_events.start(
+            session_key,
+            movie_id,
+            get_client_ip(request),
+            user_id=request.user.id if request.user.is_authenticated else None,
+        )
+    except ValueError:
+        return JsonResponse({"error": "Invalid client address"}, status=400)
+    return JsonResponse({"watch_id": str(session_key), "status": "started"})
 
 
 @csrf_exempt
@@ -249,6 +448,25 @@ def stop_watch(request, watch_id):
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request"}, status=400)
 
+    if not watch_id.isdigit():
+        try:
+            session_key = uuid.UUID(watch_id)
+        except ValueError:
+            return JsonResponse({"error": "Watch session not found"}, status=404)
+        started = watch_events.pending_start(session_key)
+        if started is None:
+            row = (WatchHistory.objects.filter(session_key=session_key)
+                   .values_list("start_time", "end_time", "duration").first())
+            if row is None:
+                return JsonResponse({"error": "Watch session not found"}, status=404)
+            started, end_time, duration = row
+            if end_time is not None:  # already closed: nothing to queue
+                return JsonResponse({"status": "stopped", "duration": _format_duration(duration)})
+        _, ended = watch_events.stop(session_key)
+        duration = ended - started if started else None
+        return JsonResponse({"status": "stopped", "duration": _format_duration(duration)})
+
+    # sessions started before write-behind ingestion are addressed by row id
     try:
         watch = WatchHistory.objects.get(id=watch_id)
     except WatchHistory.DoesNotExist:
@@ -258,19 +476,11 @@ def stop_watch(request, watch_id):
         watch.end_time = timezone.now()
         if watch.start_time:
             watch.duration = watch.end_time - watch.start_time
-        watch.save(update_fields=["end_time", "duration"])
-
-    formatted_duration = "00:00:00"
-    if watch.duration:
-        total_seconds = int(watch.duration.total_seconds())
-        h, m, s = (
-            total_seconds // 3600,
-            (total_seconds % 3600) // 60,
-            total_seconds % 60,
-        )
-        formatted_duration = f"{h:02d}:{m:02d}:{s:02d}"
+        watch.save(update_fields=["end_time", "duration", "last_seen"])
+        presence.leave(watch.movie_id, watch.id)
+        hub.notify(watch.movie_id)
 
-    return JsonResponse({"status": "stopped", "duration": formatted_duration})
+    return JsonResponse({"status": "stopped", "duration": _format_duration(watch.duration)})
 
 
 # ============================================================
@@ -280,36 +490,129 @@ def admin_dashboard(request):
     return render(request, "movies/admin_dashboard.html", {})
 
 
-def _is_online(last_watch):
-    if not last_watch:
-        return False
-    return last_watch.end_time is None and last_watch.start_time and (timezone.now() - last_watch.start_time <= timedelta(minutes=ACTIVE_WINDOW_MINUTES))
+VISITOR_SORTS = {
+    "last_visit": "last_visit",
+    "first_visit": "first_visit",
+    "visits": "visit_count",
+    "country": "country",
+    "ip": "ip_address",
+}
+VISITORS_PAGE_SIZE = 50
+VISITORS_MAX_PAGE_SIZE = 200
+MAP_MAX_CELLS = 2000
+
+
+def _online_sessions(cutoff):
+    """Open watch sessions started after `cutoff` (partial index watch_open_start_idx)."""
+    return WatchHistory.objects.filter(end_time__isnull=True, start_time__gte=cutoff)
 
 
 def visitor_stats_api(request):
-    visitors = Visitor.objects.all().order_by("-last_visit")
-    rows = []
-    for v in visitors:
-        last_watch = WatchHistory.objects.filter(ip_address=v.ip_address).select_related("movie").order_by("-start_time").first()
-        rows.append({
-            "id": v.id,
-            "name": v.ip_address,
-            "ip": v.ip_address,
-            "country": v.country or "",
-            "city": v.city or "",
-            "online": _is_online(last_watch),
-            "visit_count": WatchHistory.objects.filter(ip_address=v.ip_address).count(),
-            "last_visit": v.last_visit.strftime("%Y-%m-%d %H:%M:%S") if v.last_visit else "",
-            "last_movie": last_watch.movie.name if last_watch and last_watch.movie else "-",
-        })
-    return JsonResponse({"visitors": rows})
+    """
+    One page of visitors with their last watched movie and online flag.
+    GET params: page, page_size, sort (last_visit|first_visit|visits|country|ip,
+    "-" prefix for descending), online=1, country=<name>, q=<ip/country/city>.
+    Constant number of queries whatever the page size.
+    """
+    cutoff = timezone.now() - timedelta(minutes=ACTIVE_WINDOW_MINUTES)
+    last_watch = WatchHistory.objects.filter(ip_address=OuterRef("ip_address")).order_by("-start_time")
+    visitors = Visitor.objects.annotate(
+        last_movie=Subquery(last_watch.values("movie__name")[:1]),
+        online=Exists(_online_sessions(cutoff).filter(ip_address=OuterRef("ip_address"))),
+    )
+
+    if request.GET.get("online") in ("1", "true"):
+        visitors = visitors.filter(online=True)
+    country = (request.GET.get("country") or "").strip()
+    if country:
+        visitors = visitors.filter(country=country)
+    q = (request.GET.get("q") or "").strip()
+    if q:
+        visitors = visitors.filter(Q(ip_address__startswith=q) | Q(country__icontains=q) | Q(city__icontains=q))
+
+    sort = request.GET.get("sort") or "-last_visit"
+    field = VISITOR_SORTS.get(sort.lstrip("-"), "last_visit")
+    descending = sort.startswith("-")
+    visitors = visitors.order_by(f"-{field}" if descending else field, "-id" if descending else "id")
+
+    try:
+        page_size = min(max(int(request.GET.get("page_size", VISITORS_PAGE_SIZE)), 1), VISITORS_MAX_PAGE_SIZE)
+    except ValueError:
+        page_size = VISITORS_PAGE_SIZE
+    page = Paginator(visitors, page_size).get_page(request.GET.get("page"))
+
+    rows = [{
+        "id": v.id,
+        "name": v.ip_address,
+        "ip": v.ip_address,
+        "country": v.country or "",
+        "city": v.city or "",
+        "online": v.online,
+        "visit_count": v.visit_count,
+        "last_visit": v.last_visit.strftime("%Y-%m-%d %H:%M:%S") if v.last_visit else "",
+        "last_movie": v.last_movie or "-",
+    } for v in page.object_list]
+
+    total = Visitor.objects.count()
+    online = _online_sessions(cutoff).values("ip_address").distinct().count()
+    return JsonResponse({
+        "visitors": rows,
+        "page": page.number,
+        "num_pages": page.paginator.num_pages,
+        "count": page.paginator.count,
+        "summary": {"total": total, "online": online, "offline": max(total - online, 0)},
+    })
 
 
 def visitor_chart_data(request):
-    today = timezone.now().date()
-    days = [today - timedelta(days=i) for i in range(6, -1, -1)]
-    data = [{"date": d.strftime("%Y-%m-%d"), "count": Visitor.objects.filter(last_visit__date=d).count()} for d in days]
-    return JsonResponse({"data": data})
+    """
+    GET ?range=7|30|90|365 (days, default 7)
+    Plays ("count") and distinct visitors per local day, zero-filled;
+    closed days come from the DailyVisitStats rollup.
+    """
+    try:
+        days = int(request.GET.get("range", 7))
+    except ValueError:
+        days = 7
+    if days not in CHART_RANGES:
+        days = 7
+    maybe_rollup()
+    data = [
+        {"date": day.strftime("%Y-%m-%d"), "count": visits, "visitors": visitors}
+        for day, visits, visitors in daily_visit_series(days)
+    ]
+    return JsonResponse({"range": days, "data": data})
+
+
+TOP_MOVIES_LIMIT = 10
+
+
+def movie_stats_api(request):
+    """
+    GET ?range=7|30|90|365 (days, default 7)
+    Most played movies of the range with plays, downloads and hours watched,
+    summed from the daily MovieStatsRollup rows.
+    """
+    try:
+        days = int(request.GET.get("range", 7))
+    except ValueError:
+        days = 7
+    if days not in CHART_RANGES:
+        days = 7
+    maybe_rollup()
+    top = list(movie_stats_totals(days).order_by("-plays", "-downloads")[:TOP_MOVIES_LIMIT])
+    names = dict(Movie.objects.filter(id__in=[t["movie_id"] for t in top]).values_list("id", "name"))
+    data = [
+        {
+            "movie_id": t["movie_id"],
+            "name": names.get(t["movie_id"], ""),
+            "plays": t["plays"],
+            "downloads": t["downloads"],
+            "watch_hours": round(t["watch_seconds"] / 3600, 1),
+        }
+        for t in top
+    ]
+    return JsonResponse({"range": days, "data": data})
 
 
 def visitor_country_data(request):
@@ -318,46 +621,169 @@ def visitor_country_data(request):
 
 
 def visitor_map_data(request):
-    visitors = Visitor.objects.all()
-    payload = []
-    for v in visitors:
-        last_watch = WatchHistory.objects.filter(ip_address=v.ip_address).order_by("-start_time").first()
-        country, city, lat, lng = _safe_geoip(v.ip_address)
-        payload.append({
-            "ip": v.ip_address,
-            "country": v.country or country,
-            "city": v.city or city,
-            "lat": v.lat or lat,
-            "lng": v.lng or lng,
-            "online": _is_online(last_watch),
-            "visit_count": WatchHistory.objects.filter(ip_address=v.ip_address).count(),
-        })
+    """
+    One point per located visitor (legacy payload; the dashboard map uses
+    `visitor_map_clusters`, which scales with the viewport instead).
+    """
+    cutoff = timezone.now() - timedelta(minutes=ACTIVE_WINDOW_MINUTES)
+    visitors = Visitor.objects.exclude(geohash="").annotate(
+        online=Exists(_online_sessions(cutoff).filter(ip_address=OuterRef("ip_address"))),
+    )
+    payload = [{
+        "ip": v.ip_address,
+        "country": v.country,
+        "city": v.city,
+        "lat": v.lat,
+        "lng": v.lng,
+        "online": v.online,
+        "visit_count": v.visit_count,
+    } for v in visitors]
+    # never resolved yet: fill in in the background, show on a later refresh
+    geo_queue.enqueue(Visitor.objects.filter(geo_checked_at__isnull=True).values_list("ip_address", flat=True)[:1000])
     return JsonResponse({"data": payload})
 
 
+def _parse_bbox(raw):
+    """"west,south,east,north" -> floats (clamped), or the whole world."""
+    try:
+        west, south, east, north = (float(x) for x in (raw or "").split(","))
+    except ValueError:
+        return -180.0, -90.0, 180.0, 90.0
+    if east - west >= 360:
+        return -180.0, max(south, -90.0), 180.0, min(north, 90.0)
+
+    def wrap(lng):
+        # Leaflet keeps counting past +-180 when panning around the globe
+        return lng if -180 <= lng <= 180 else (lng + 180) % 360 - 180
+
+    return wrap(west), max(south, -90.0), wrap(east), min(north, 90.0)
+
+
+def visitor_map_clusters(request):
+    """
+    GET ?bbox=west,south,east,north&zoom=<leaflet zoom>
+    Located visitors inside the box per geohash cell (longer prefixes at
+    higher zoom): visitor count, online count and centroid of each cell.
+    Counts come from the pre-aggregated VisitorMapCell rows and online
+    counts from the open sessions only, so the work depends on the viewport
+    and current viewers, not on the total number of visitors.
+    """
+    west, south, east, north = _parse_bbox(request.GET.get("bbox"))
+    try:
+        zoom = int(request.GET.get("zoom", 2))
+    except ValueError:
+        zoom = 2
+    precision = precision_for_zoom(zoom)
+    cutoff = timezone.now() - timedelta(minutes=ACTIVE_WINDOW_MINUTES)
+
+    # cells are filtered on their center: widen the box by half a cell
+    lat_pad, lng_pad = (size / 2 for size in cell_size(precision))
+    cells = VisitorMapCell.objects.filter(
+        precision=precision, visitors__gt=0, lat__gte=south - lat_pad, lat__lte=north + lat_pad,
+    )
+    if west <= east:
+        cells = cells.filter(lng__gte=west - lng_pad, lng__lte=east + lng_pad)
+    else:  # box crosses the antimeridian
+        cells = cells.filter(Q(lng__gte=west - lng_pad) | Q(lng__lte=east + lng_pad))
+    cells = cells.order_by("-visitors")[:MAP_MAX_CELLS]
+
+    online_ips = _online_sessions(cutoff).values("ip_address")
+    online = Counter(
+        geohash[:precision] for geohash in
+        Visitor.objects.filter(ip_address__in=Subquery(online_ips)).exclude(geohash="").values_list("geohash", flat=True)
+    )
+    return JsonResponse({
+        "precision": precision,
+        "cells": [{
+            "cell": c.cell,
+            "count": c.visitors,
+            "online": online.get(c.cell, 0),
+            "lat": round(c.lat_sum / c.visitors, 5),
+            "lng": round(c.lng_sum / c.visitors, 5),
+        } for c in cells],
+    })
+
+
+# ============================================================
+# History exports (staff only)
+# ============================================================
+@staff_member_required
+def export_history(request, kind):
+    """
+    GET /api/export/<watch|downloads|visitors>/?format=csv|ndjson&gzip=1&since=&until=
+    Streams the whole table in id order in constant memory. since/until
+    (ISO date or datetime) filter on start_time, downloaded_at or last_visit.
+    """
+    if kind not in export_sources():
+        return JsonResponse({"error": "Unknown export"}, status=404)
+    fmt = request.GET.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({"error": "format must be csv or ndjson"}, status=400)
+    try:
+        since = parse_bound(request.GET.get("since"))
+        until = parse_bound(request.GET.get("until"))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    compress = request.GET.get("gzip") in ("1", "true", "yes")
+
+    qs, fields = export_queryset(kind, since, until)
+    blocks = iter_export(qs, fields, fmt, compress)
+    if isinstance(request, ASGIRequest):
+        blocks = aiter_blocks(blocks)
+    response = StreamingHttpResponse(
+        blocks, content_type="application/gzip" if compress else EXPORT_CONTENT_TYPES[fmt],
+    )
+    filename = f"{kind}-{timezone.now():%Y%m%d-%H%M%S}.{fmt}" + (".gz" if compress else "")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 def search_suggestions(request):
+    """
+    Live search box suggestions, answered from the in-process prefix index.
+    Only falls back to the database (typo-tolerant search) when no title
+    word starts with what was typed.
+    """
     q = request.GET.get('q', '')
-    matches = Movie.objects.filter(name__icontains=q)[:5]
-    results = [{'id': m.id, 'name': m.name} for m in matches]
+    title_index.ensure_loaded(version=get_version(MOVIES_VERSION))
+    results = [{'id': movie_id, 'name': name} for movie_id, name in title_index.suggest(q, SUGGESTIONS_LIMIT)]
+    if not results:
+        matches = search_movies(Movie.objects.only('id', 'name'), q)[:SUGGESTIONS_LIMIT]
+        results = [{'id': m.id, 'name': m.name} for m in matches]
     return JsonResponse(results, safe=False)
 
 
+def _latest_movies_etag(request):
+    """ETag from the shared movies version: answering a 304 costs no query."""
+    return f'"{get_version(MOVIES_VERSION)}-{request.GET.get("after", "")}"'
+
+
+@condition(etag_func=_latest_movies_etag)
 def latest_movies(request):
-    recent_time = now() - timedelta(minutes=10)
-    movies = Movie.objects.filter(uploaded_at__gte=recent_time).order_by('-uploaded_at')
-    data = [
-        {
-            'id': m.id,
-            'name': m.name,
-            'image_url': m.image_url or '',
-            'genre': m.genre or '',
-            'download_url': m.download_url or ''
-        }
-        for m in movies
-    ]
-    return JsonResponse(data, safe=False)
+    """
+    Delta feed of newly added movies for the home page poller.
+
+    GET ?after=<id> returns movies with a larger id, oldest first, plus the
+    cursor to send next time. Clients echo the ETag in If-None-Match and get
+    an empty 304 while the catalog is unchanged. Without `after`, movies
+    uploaded in the last 10 minutes are returned.
+    """
+    after = request.GET.get('after', '')
+    if after.isdigit():
+        movies = list(Movie.objects.filter(id__gt=int(after)).order_by('id')[:LATEST_MOVIES_LIMIT])
+        cursor = movies[-1].id if movies else int(after)
+    else:
+        recent_time = now() - timedelta(minutes=10)
+        movies = list(Movie.objects.filter(uploaded_at__gte=recent_time).order_by('id')[:LATEST_MOVIES_LIMIT])
+        cursor = movies[-1].id if movies else (Movie.objects.aggregate(last=Max('id'))['last'] or 0)
+
+    return JsonResponse({
+        'movies': [_movie_card(m) for m in movies],
+        'cursor': cursor,
+    })
 
 
 def comment_count(request, movie_id):
-    count = Comment.objects.filter(movie_id=movie_id).count()
+    count = Movie.objects.filter(id=movie_id).values_list("comment_count", flat=True).first() or 0
     return JsonResponse({'movie_id': movie_id, 'comment_count': count})
@@ -3,6 +3,10 @@ ASGI config for rwanda_film_vault project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is the production entry point (gunicorn + uvicorn worker, see Procfile)
+so that long-lived responses such as the watch page event stream
+(movies.views.movie_events) don't tie up a worker thread each.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
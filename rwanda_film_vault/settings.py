@@ -8,6 +8,7 @@ See https://docs.djangoproject.com/en/5.2/topics/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url  # ✅ Added for Render PostgreSQL support
 from dotenv import load_dotenv
 load_dotenv()  # ✅ This ensures .env file is loaded
@@ -29,6 +30,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Full-text / trigram search lookups
     'movies',                   # Your app
     'django.contrib.humanize',  # Human-readable numbers, dates, etc.
 ]
@@ -77,6 +79,22 @@ DATABASES = {
     )
 }
 
+# --- Cache ---
+# File-based so every gunicorn worker on the box shares the catalog
+# version keys and cached pages; no external service needed. Its add/incr
+# are not atomic across processes; movies/utils/cache.py does not rely on that.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'DJANGO_CACHE_DIR',
+            os.path.join(tempfile.gettempdir(), 'rwanda_film_vault_cache'),
+        ),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
 # --- Password Validation ---
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -97,6 +115,14 @@ STATICFILES_DIRS = [BASE_DIR / "static"]  # Optional: custom static folder
 STATIC_ROOT = BASE_DIR / "staticfiles"   # For production
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# --- Media (uploaded videos, MP4 conversions and HLS renditions) ---
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+# Whether MEDIA_URL is reachable by browsers. Django only serves it with DEBUG (urls.py); set
+# MEDIA_SERVED=True once a web server or CDN serves MEDIA_ROOT. Until then the watch page plays
+# video_url instead of the converted MP4 and HLS files (Movie.playback_url / hls_url).
+MEDIA_SERVED = DEBUG or os.environ.get('MEDIA_SERVED', '') == 'True'
+
 # --- Default Primary Key Field Type ---
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
@@ -5,3 +7,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include(('movies.urls', 'movies'), namespace='movies')),
 ]
+
+# Uploaded and transcoded media; only with DEBUG on, production serves MEDIA_ROOT from the web server / CDN
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)